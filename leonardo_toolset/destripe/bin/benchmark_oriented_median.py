@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark oriented_median, as used by GuidedUpsample.GF, against the
+previous implementation, which stacked rx shifted copies of the slice on CPU.
+
+    python -m leonardo_toolset.destripe.bin.benchmark_oriented_median --m 2048 --n 2048
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from leonardo_toolset.destripe.guided_filter_upsample import oriented_median
+
+
+def oriented_median_reference(
+    b,
+    lval,
+):
+    rx = len(lval)
+    _, _, m, n = b.shape
+    b_batch = torch.zeros(rx, 1, 1, m, n)
+    for ind, r in enumerate(range(rx)):
+        data = F.pad(b, (lval.max(), lval.max(), rx // 2, rx // 2), "reflect")
+        b_batch[ind] = data[
+            :, :, r : r + m, lval[ind] - lval.min() : lval[ind] - lval.min() + n
+        ].cpu()
+    return torch.median(b_batch, 0)[0].to(b.device)
+
+
+def timeit(fn, n_repeats):
+    fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    t0 = time.perf_counter()
+    for _ in range(n_repeats):
+        out = fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return (time.perf_counter() - t0) / n_repeats, out
+
+
+def main():
+    p = argparse.ArgumentParser(description="benchmark oriented_median")
+    p.add_argument("--m", type=int, default=1024)
+    p.add_argument("--n", type=int, default=1024)
+    p.add_argument("--rx", type=int, default=49)
+    p.add_argument("--angle", type=float, default=5.0)
+    p.add_argument("--n_repeats", type=int, default=3)
+    p.add_argument("--device", type=str, default="cpu")
+    args = p.parse_args()
+
+    b = torch.randn(1, 1, args.m, args.n, device=args.device)
+    lval = np.arange(args.rx) - args.rx // 2
+    lval = np.round(lval * np.tan(np.deg2rad(args.angle))).astype(np.int32)
+
+    t_ref, out_ref = timeit(lambda: oriented_median_reference(b, lval), args.n_repeats)
+    t_new, out_new = timeit(lambda: oriented_median(b, lval), args.n_repeats)
+
+    print("slice: {}x{}, rx={}, angle={}".format(args.m, args.n, args.rx, args.angle))
+    print("reference:       {:.3f} s".format(t_ref))
+    print("oriented_median: {:.3f} s ({:.1f}x)".format(t_new, t_ref / t_new))
+    print("max abs difference: {:.3g}".format((out_ref - out_new).abs().max().item()))
+
+
+if __name__ == "__main__":
+    main()
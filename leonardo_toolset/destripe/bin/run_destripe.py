@@ -7,6 +7,7 @@ users' virtualenv when the parent module is installed using pip.
 """
 
 import argparse
+import os
 import logging
 import sys
 import traceback
@@ -227,6 +228,154 @@ class Args(argparse.Namespace):
             type=str,
         )
 
+        p.add_argument(
+            "--batch_size",
+            action="store",
+            dest="batch_size",
+            default=1,
+            type=int,
+        )
+
+        p.add_argument(
+            "--warm_start",
+            type=bool_args,
+            default=False,
+        )
+
+        p.add_argument(
+            "--warm_start_n_epochs",
+            action="store",
+            dest="warm_start_n_epochs",
+            default=100,
+            type=int,
+        )
+
+        p.add_argument(
+            "--convergence_tol",
+            action="store",
+            dest="convergence_tol",
+            default=0,
+            type=float,
+        )
+
+        p.add_argument(
+            "--convergence_window",
+            action="store",
+            dest="convergence_window",
+            default=20,
+            type=int,
+        )
+
+        p.add_argument(
+            "--min_n_epochs",
+            action="store",
+            dest="min_n_epochs",
+            default=50,
+            type=int,
+        )
+
+        p.add_argument(
+            "--n_workers",
+            action="store",
+            dest="n_workers",
+            default=1,
+            type=int,
+        )
+
+        p.add_argument(
+            "--n_threads_per_worker",
+            action="store",
+            dest="n_threads_per_worker",
+            default=None,
+            type=int,
+        )
+
+        p.add_argument(
+            "--n_prefetch",
+            action="store",
+            dest="n_prefetch",
+            default=1,
+            type=int,
+        )
+
+        p.add_argument(
+            "--cache_dir",
+            action="store",
+            dest="cache_dir",
+            default=None,
+            type=str,
+        )
+
+        p.add_argument(
+            "--keyframe_interval",
+            action="store",
+            dest="keyframe_interval",
+            default=1,
+            type=int,
+        )
+
+        p.add_argument(
+            "--keyframe_n_epochs",
+            action="store",
+            dest="keyframe_n_epochs",
+            default=0,
+            type=int,
+        )
+
+        p.add_argument(
+            "--tile_size",
+            action="store",
+            dest="tile_size",
+            default=None,
+            type=int,
+        )
+
+        p.add_argument(
+            "--tile_overlap",
+            action="store",
+            dest="tile_overlap",
+            default=64,
+            type=int,
+        )
+
+        p.add_argument(
+            "--shape_bucket",
+            action="store",
+            dest="shape_bucket",
+            default=None,
+            type=int,
+        )
+
+        p.add_argument(
+            "--torch_compile",
+            type=bool_args,
+            default=False,
+        )
+
+        p.add_argument(
+            "--post_n_epochs",
+            action="store",
+            dest="post_n_epochs",
+            default=1000,
+            type=int,
+        )
+
+        p.add_argument(
+            "--post_n_epochs_compose",
+            action="store",
+            dest="post_n_epochs_compose",
+            default=1000,
+            type=int,
+        )
+
+        p.add_argument(
+            "--post_convergence_tol",
+            action="store",
+            dest="post_convergence_tol",
+            default=0,
+            type=float,
+        )
+
         # .train()
 
         p.add_argument(
@@ -243,6 +392,7 @@ class Args(argparse.Namespace):
             dest="x",
             default=None,
             type=str,
+            nargs="+",
         )
 
         p.add_argument(
@@ -251,6 +401,7 @@ class Args(argparse.Namespace):
             dest="mask",
             default=None,
             type=str,
+            nargs="+",
         )
 
         p.add_argument(
@@ -307,6 +458,7 @@ class Args(argparse.Namespace):
             dest="save_path",
             type=str,
             required=True,
+            nargs="+",
         )
 
         ns, unknown = p.parse_known_args(namespace=self)
@@ -320,6 +472,9 @@ def main():
     try:
         args = Args()
         dbg = args.debug
+        if dbg:
+            # also counts the JAX/torch copies of the destripe pipeline
+            os.environ["LEONARDO_DEBUG"] = "1"
 
         exe = DeStripe(
             args.resample_ratio,
@@ -334,20 +489,54 @@ def main():
             args.n_neighbors,
             args.backend,
             args.device,
+            batch_size=args.batch_size,
+            warm_start=args.warm_start,
+            warm_start_n_epochs=args.warm_start_n_epochs,
+            convergence_tol=args.convergence_tol,
+            convergence_window=args.convergence_window,
+            min_n_epochs=args.min_n_epochs,
+            n_workers=args.n_workers,
+            n_threads_per_worker=args.n_threads_per_worker,
+            n_prefetch=args.n_prefetch,
+            cache_dir=args.cache_dir,
+            keyframe_interval=args.keyframe_interval,
+            keyframe_n_epochs=args.keyframe_n_epochs,
+            tile_size=args.tile_size,
+            tile_overlap=args.tile_overlap,
+            shape_bucket=args.shape_bucket,
+            torch_compile=args.torch_compile,
+            post_n_epochs=args.post_n_epochs,
+            post_n_epochs_compose=args.post_n_epochs_compose,
+            post_convergence_tol=args.post_convergence_tol,
         )
-        _ = exe.train(
-            args.save_path,
-            args.is_vertical,
-            args.x,
-            args.mask,
-            args.fusion_mask,
-            args.illu_orient,
-            args.angle_offset,
-            args.display,
-            args.display_angle_orientation,
-            args.non_positive,
-            **getattr(args, "kwargs", {}),
-        )
+        if (args.x is not None) and (len(args.x) > 1):
+            # several volumes of the same geometry share one pipeline
+            _ = exe.train_many(
+                args.save_path,
+                args.is_vertical,
+                args.x,
+                args.mask,
+                args.illu_orient,
+                args.angle_offset,
+                display=args.display,
+                display_angle_orientation=args.display_angle_orientation,
+                non_positive=args.non_positive,
+                **getattr(args, "kwargs", {}),
+            )
+        else:
+            _ = exe.train(
+                args.save_path[0],
+                args.is_vertical,
+                None if args.x is None else args.x[0],
+                None if args.mask is None else args.mask[0],
+                args.fusion_mask,
+                args.illu_orient,
+                args.angle_offset,
+                args.display,
+                args.display_angle_orientation,
+                args.non_positive,
+                **getattr(args, "kwargs", {}),
+            )
 
     except Exception as e:
         log.error("=============================================")
@@ -22,6 +22,24 @@ from leonardo_toolset.destripe.utils import (
     ensure_abs_tif,
     open_or_init_mm,
     finalize_save,
+    stack_slice_data,
+    ConvergenceMonitor,
+    to_output_slice,
+    slice_stats,
+    as_picklable,
+    from_picklable,
+    limit_threads_env,
+    SlicePrefetcher,
+    keyframe_schedule,
+    tile_offsets,
+    tile_view,
+    TileBlender,
+    bucket_size,
+    default_cache_dir,
+    preview_view,
+    jax_to_torch,
+    interop_copies,
+    half_spectrum_index,
 )
 from leonardo_toolset.destripe.utils_torch import (
     generate_mask_dict_torch,
@@ -43,6 +61,7 @@ try:
         generate_mask_dict_jax,
         initialize_cmplx_model_jax,
         update_jax,
+        enable_compilation_cache,
     )
 
     # from jax import jit
@@ -56,6 +75,7 @@ except Exception as e:
 from torch.nn import functional as F
 import tempfile
 import gc
+import multiprocessing
 
 
 class DeStripe:
@@ -80,6 +100,25 @@ class DeStripe:
         n_neighbors: int = 16,
         backend: str = "jax",
         device: str = None,
+        batch_size: int = 1,
+        warm_start: bool = False,
+        warm_start_n_epochs: int = 100,
+        convergence_tol: float = 0,
+        convergence_window: int = 20,
+        min_n_epochs: int = 50,
+        n_workers: int = 1,
+        n_threads_per_worker: int = None,
+        n_prefetch: int = 1,
+        cache_dir: str = None,
+        keyframe_interval: int = 1,
+        keyframe_n_epochs: int = 0,
+        tile_size: int = None,
+        tile_overlap: int = 64,
+        shape_bucket: int = None,
+        torch_compile: bool = False,
+        post_n_epochs: int = 1000,
+        post_n_epochs_compose: int = 1000,
+        post_convergence_tol: float = 0,
     ):
         """
         Initialize the DeStripe class with destriping and training parameters.
@@ -112,6 +151,68 @@ class DeStripe:
                 Backend to use ('jax' or 'torch').
             device : str, optional
                 Device to use ('cuda', 'cpu').
+            batch_size : int, optional
+                Number of slices trained jointly in one vectorized optimization.
+                Larger values amortize per-epoch overhead at the cost of memory.
+            warm_start : bool, optional
+                Whether to initialize the graph neural network of each slice
+                with the converged parameters and optimizer state of the previous slice.
+            warm_start_n_epochs : int, optional
+                Number of epochs for warm-started slices.
+            convergence_tol : float, optional
+                Relative change of the loss, averaged over ``convergence_window`` epochs,
+                below which training of a slice stops early. 0 disables early stopping,
+                so that every slice is trained for the full number of epochs.
+            convergence_window : int, optional
+                Number of epochs over which the loss is averaged for early stopping.
+            min_n_epochs : int, optional
+                Minimum number of epochs before early stopping may happen.
+            n_workers : int, optional
+                Number of worker processes destriping slices in parallel. Each worker builds
+                its own pipeline and writes into the work memmap, so ``save_path``
+                must be given to ``train`` for ``n_workers > 1``. Workers are spawned,
+                so scripts should call ``train`` under ``if __name__ == "__main__":``.
+            n_threads_per_worker : int, optional
+                Number of BLAS/XLA/PyTorch threads per worker.
+                Defaults to the number of CPU cores divided by ``n_workers``.
+            n_prefetch : int, optional
+                Number of batches of slices read ahead in a background thread while
+                the current batch is trained. 0 reads every slice synchronously.
+            cache_dir : str, optional
+                Directory caching the wedge masks, neighbour graphs and TV spectra,
+                which only depend on the geometry. Defaults to ~/.cache/leonardo_toolset
+                (or $LEONARDO_CACHE_DIR). An empty string keeps the cache in memory only.
+            keyframe_interval : int, optional
+                Only every keyframe_interval-th slice (and the last one) is trained
+                from scratch. Slices in between reuse the parameters of the nearest
+                keyframe. 1 trains every slice. Ignored for ``n_workers > 1``.
+            keyframe_n_epochs : int, optional
+                Number of epochs to fine-tune the slices in between keyframes,
+                starting from the keyframe parameters. 0 runs inference only.
+            tile_size : int, optional
+                If given, every slice is split into overlapping tiles of this width
+                along the axis perpendicular to the stripes, which are destriped
+                independently (jointly, for ``batch_size > 1``) and blended back.
+                Memory is then bounded by the tile size instead of the plane size.
+            tile_overlap : int, optional
+                Overlap between neighboring tiles, blended with a linear ramp.
+            shape_bucket : int, optional
+                If given, slices are padded up to a multiple of shape_bucket pixels,
+                so that acquisitions of slightly different sizes reuse the compiled
+                pipeline. Compiled JAX executables are cached on disk under
+                ``cache_dir`` in any case.
+            torch_compile : bool, optional
+                Whether to compile the per-epoch loss and network evaluation of the
+                PyTorch backend with ``torch.compile``. Falls back to eager mode if
+                compilation fails. Ignored for the JAX backend.
+            post_n_epochs : int, optional
+                Maximal number of epochs to fit the stripe models in post-processing.
+            post_n_epochs_compose : int, optional
+                Maximal number of epochs to merge positive and non-positive stripes,
+                and top and bottom illumination, in post-processing.
+            post_convergence_tol : float, optional
+                As ``convergence_tol``, for the post-processing optimizations (with the
+                same ``convergence_window`` and ``min_n_epochs``). 0 runs all epochs.
         """
         self.train_params = {
             "gf_kernel_size": guided_upsample_kernel,
@@ -124,6 +225,25 @@ class DeStripe:
             "resample_ratio": resample_ratio,
             "n_epochs": n_epochs,
             "wedge_degree": wedge_degree,
+            "batch_size": batch_size,
+            "warm_start": warm_start,
+            "warm_start_n_epochs": warm_start_n_epochs,
+            "convergence_tol": convergence_tol,
+            "convergence_window": convergence_window,
+            "min_n_epochs": min_n_epochs,
+            "n_workers": n_workers,
+            "n_threads_per_worker": n_threads_per_worker,
+            "n_prefetch": n_prefetch,
+            "cache_dir": cache_dir,
+            "keyframe_interval": keyframe_interval,
+            "keyframe_n_epochs": keyframe_n_epochs,
+            "tile_size": tile_size,
+            "tile_overlap": tile_overlap,
+            "shape_bucket": shape_bucket,
+            "torch_compile": torch_compile,
+            "post_n_epochs": post_n_epochs,
+            "post_n_epochs_compose": post_n_epochs_compose,
+            "post_convergence_tol": post_convergence_tol,
         }
         if device is None:
             self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -185,37 +305,30 @@ class DeStripe:
         )
 
     @staticmethod
-    def train_on_one_slice(
-        GuidedFilterHRModel,
+    def prepare_one_slice(
         update_method,
         sample_params: Dict,
         train_params: Dict,
         X: np.ndarray,
         mask: np.ndarray = None,
         fusion_mask: np.ndarray = None,
-        s_: int = 1,
-        z: int = 1,
         backend: str = "jax",
     ):
         """
-        Train the destriping model on a single image slice.
+        Build the Fourier-domain input and the loss masks of a single slice.
 
         Args:
-            GuidedFilterHRModel: Guided upsampling model.
             update_method: Update method for optimization.
             sample_params (dict): Sample-specific parameters.
             train_params (dict): Training parameters.
             X (np.ndarray): Input image slice.
             mask (np.ndarray): Mask for the slice.
             fusion_mask (np.ndarray): Fusion mask for the slice.
-            s_ (int): Current slice index.
-            z (int): Total number of slices.
             backend (str): Backend to use ('jax' or 'torch').
 
         Returns:
-            tuple: (output image, target image)
+            dict: Inputs of ``update_method`` for this slice.
         """
-        rng_seq = jax.random.PRNGKey(0) if backend == "jax" else None
         if sample_params["is_vertical"]:
             md = sample_params["md"]
             nd = sample_params["nd"]
@@ -228,19 +341,27 @@ class DeStripe:
         # Xd = X[:, :, :: sample_params["r"], :]
         fusion_maskd = fusion_mask[:, :, :: sample_params["r"], :]
 
-        # to Fourier
+        # to Fourier, the half spectrum is gathered from rfft2
+        to_half, to_half_conj, _, _ = half_spectrum_index(md, nd)
         if backend == "jax":
             targetf = (
-                jnp.fft.fftshift(jnp.fft.fft2(targetd), axes=(-2, -1))
+                jnp.fft.rfft2(targetd)
                 .reshape(1, targetd.shape[1], -1)[0]
-                .transpose(1, 0)[: md * nd // 2, :][..., None]
+                .transpose(1, 0)[to_half, :]
             )
+            targetf = jnp.where(to_half_conj[:, None], jnp.conj(targetf), targetf)
         else:
             targetf = (
-                torch.fft.fftshift(torch.fft.fft2(targetd), dim=(-2, -1))
+                torch.fft.rfft2(targetd)
                 .reshape(1, targetd.shape[1], -1)[0]
-                .transpose(1, 0)[: md * nd // 2, :][..., None]
+                .transpose(1, 0)[torch.from_numpy(to_half).to(targetd.device), :]
+            )
+            targetf = torch.where(
+                torch.from_numpy(to_half_conj[:, None]).to(targetd.device),
+                torch.conj(targetf),
+                targetf,
             )
+        targetf = targetf[..., None]
 
         # initialize
         generate_mask_dict_func = (
@@ -262,6 +383,42 @@ class DeStripe:
 
         aver = targetd.sum((2, 3))
 
+        mask_dict.update(
+            {
+                "mse_mask": mask[:, :, :: sample_params["r"], :],
+            }
+        )
+        # target-only loss terms, computed once per slice
+        mask_dict.update(update_method.loss.target_terms(targetd_bilinear, targets_f))
+
+        return {
+            "aver": aver,
+            "xf": targetf,
+            "y": targetd,
+            "mask_dict": mask_dict,
+            "hy": target,
+            "targets_f": targets_f,
+            "targetd_bilinear": targetd_bilinear,
+        }
+
+    @staticmethod
+    def init_one_slice(
+        update_method,
+        slice_data: Dict,
+        backend: str = "jax",
+    ):
+        """
+        Initialize network parameters and optimizer state for a single slice.
+
+        Args:
+            update_method: Update method for optimization.
+            slice_data (dict): Inputs of the slice, from ``prepare_one_slice``.
+            backend (str): Backend to use ('jax' or 'torch').
+
+        Returns:
+            tuple: (network parameters, optimizer state)
+        """
+        rng_seq = jax.random.PRNGKey(0) if backend == "jax" else None
         initialize_cmplx_model = (
             initialize_cmplx_model_jax
             if backend == "jax"
@@ -272,83 +429,90 @@ class DeStripe:
             update_method._network,
             rng_seq,
             {
-                "aver": aver,
-                "Xf": targetf,
-                "target": targetd,
-                "target_hr": target,
-                "coor": mask_dict["coor"],
+                "aver": slice_data["aver"],
+                "Xf": slice_data["xf"],
+                "target": slice_data["y"],
+                "target_hr": slice_data["hy"],
+                "coor": slice_data["mask_dict"]["coor"],
             },
         )
-
         opt_state = update_method.opt_init(net_params)
+        return net_params, opt_state
 
-        mask_dict.update(
-            {
-                "mse_mask": mask[:, :, :: sample_params["r"], :],
-            }
-        )
+    @staticmethod
+    def reconstruct_one_slice(
+        GuidedFilterHRModel,
+        Y_raw,
+        sample_params: Dict,
+        slice_data: Dict,
+        X: np.ndarray,
+        fusion_mask: np.ndarray = None,
+        backend: str = "jax",
+    ):
+        """
+        Upsample the trained low-resolution result of a single slice and
+        post-process it.
 
-        for epoch in tqdm.tqdm(
-            range(train_params["n_epochs"]),
-            leave=False,
-            desc="for {} ({} slices in total): ".format(s_, z),
-        ):
-            l, net_params, opt_state, Y_raw = update_method(
-                epoch,
-                net_params,
-                opt_state,
-                aver,
-                targetf,
-                targetd,
-                mask_dict,
-                target,
-                targets_f,
-                targetd_bilinear,
-            )
+        Args:
+            GuidedFilterHRModel: Guided upsampling model.
+            Y_raw: Low-resolution output of the graph neural network.
+            sample_params (dict): Sample-specific parameters.
+            slice_data (dict): Inputs of the slice, from ``prepare_one_slice``.
+            X (np.ndarray): Input image slice.
+            fusion_mask (np.ndarray): Fusion mask for the slice.
+            backend (str): Backend to use ('jax' or 'torch').
 
+        Returns:
+            tuple: (output image, target image)
+        """
+        target = slice_data["hy"]
         Y_GU = GuidedFilterHRModel(
             Y_raw,
             X,
-            targetd,
+            slice_data["y"],
             target,
-            mask_dict["coor"],
+            slice_data["mask_dict"]["coor"],
             fusion_mask,
             sample_params["angle_offset_individual"],
             backend=backend,
         )
 
         if len(sample_params["illu_orient"]) > 0:
+            # post_process_module works on tensors; JAX arrays are handed
+            # over as DLPack views where possible
+            device = GuidedFilterHRModel.device
             if backend == "jax":
-                Y_GNN = np.asarray(
+                Y_GNN = jax_to_torch(
                     jax.image.resize(
                         Y_raw,
                         Y_GU.shape,
                         method="bilinear",
-                    )
+                    ),
+                    device,
                 )
+                X = jax_to_torch(X, device)
+                fusion_mask = jax_to_torch(fusion_mask, device)
             else:
-                Y_GNN = np.asarray(
-                    F.interpolate(
-                        Y_raw,
-                        Y_GU.shape[-2:],
-                        mode="bilinear",
-                        align_corners=True,
-                    )
+                Y_GNN = F.interpolate(
+                    Y_raw,
+                    Y_GU.shape[-2:],
+                    mode="bilinear",
+                    align_corners=True,
                 )
 
             Y = post_process_module(
-                np.asarray(X) if backend == "jax" else X.cpu().data.numpy(),
+                X,
                 Y_GU,
                 Y_GNN,
                 angle_offset_individual=sample_params["angle_offset_individual"],
-                fusion_mask=(
-                    np.asarray(fusion_mask)
-                    if backend == "jax"
-                    else fusion_mask.cpu().data.numpy()
-                ),
+                fusion_mask=fusion_mask,
+                device=device,
                 illu_orient=sample_params["illu_orient"],
                 non_positive=sample_params["non_positive"],
                 allow_stripe_deviation=sample_params["allow_stripe_deviation"],
+                n_epochs=sample_params["post_n_epochs"],
+                n_epochs_compose=sample_params["post_n_epochs_compose"],
+                solver=sample_params["post_solver"],
             )
         else:
             Y = 10**Y_GU
@@ -358,6 +522,556 @@ class DeStripe:
             else 10 ** target[0, 0].cpu().data.numpy()
         )
 
+    @staticmethod
+    def train_on_one_slice(
+        GuidedFilterHRModel,
+        update_method,
+        sample_params: Dict,
+        train_params: Dict,
+        X: np.ndarray,
+        mask: np.ndarray = None,
+        fusion_mask: np.ndarray = None,
+        s_: int = 1,
+        z: int = 1,
+        backend: str = "jax",
+        warm_state: Dict = None,
+        snapshots: list = None,
+    ):
+        """
+        Train the destriping model on a single image slice.
+
+        Args:
+            GuidedFilterHRModel: Guided upsampling model.
+            update_method: Update method for optimization.
+            sample_params (dict): Sample-specific parameters.
+            train_params (dict): Training parameters.
+            X (np.ndarray): Input image slice.
+            mask (np.ndarray): Mask for the slice.
+            fusion_mask (np.ndarray): Fusion mask for the slice.
+            s_ (int): Current slice index.
+            z (int): Total number of slices.
+            backend (str): Backend to use ('jax' or 'torch').
+            warm_state (dict): If given, training starts from the parameters and
+                optimizer state stored here by the previous slice (if any),
+                and the converged state of this slice is stored back.
+                An optional "n_epochs" entry overrides ``warm_start_n_epochs``,
+                0 runs inference only.
+            snapshots (list): If given, a snapshot of the trained parameters
+                and optimizer state of the slice is appended to it.
+
+        Returns:
+            tuple: (output image, target image)
+        """
+        slice_data = DeStripe.prepare_one_slice(
+            update_method,
+            sample_params,
+            train_params,
+            X,
+            mask,
+            fusion_mask,
+            backend=backend,
+        )
+        if (warm_state is not None) and ("net_params" in warm_state):
+            net_params, opt_state = warm_state["net_params"], warm_state["opt_state"]
+            step0 = warm_state["step"]
+            n_epochs = warm_state.get("n_epochs", train_params["warm_start_n_epochs"])
+        else:
+            net_params, opt_state = DeStripe.init_one_slice(
+                update_method,
+                slice_data,
+                backend=backend,
+            )
+            step0, n_epochs = 0, train_params["n_epochs"]
+
+        monitor = ConvergenceMonitor(
+            train_params["convergence_tol"],
+            train_params["convergence_window"],
+            train_params["min_n_epochs"],
+        )
+        epoch = -1
+        for epoch in tqdm.tqdm(
+            range(n_epochs),
+            leave=False,
+            desc="for {} ({} slices in total): ".format(s_, z),
+        ):
+            l, net_params, opt_state, Y_raw = update_method(
+                step0 + epoch,
+                net_params,
+                opt_state,
+                slice_data["aver"],
+                slice_data["xf"],
+                slice_data["y"],
+                slice_data["mask_dict"],
+                slice_data["hy"],
+                slice_data["targets_f"],
+                slice_data["targetd_bilinear"],
+            )
+            if monitor(epoch, l):
+                break
+        if epoch < 0:
+            Y_raw = update_method.predict(
+                net_params,
+                slice_data["aver"],
+                slice_data["xf"],
+                slice_data["y"],
+                slice_data["mask_dict"],
+                slice_data["hy"],
+                slice_data["targets_f"],
+                slice_data["targetd_bilinear"],
+            )
+        if snapshots is not None:
+            net_params_, opt_state_ = update_method.snapshot(net_params, opt_state)
+            snapshots.append(
+                {
+                    "net_params": net_params_,
+                    "opt_state": opt_state_,
+                    "step": step0 + epoch + 1,
+                }
+            )
+        if warm_state is not None:
+            warm_state.update(
+                {
+                    "net_params": net_params,
+                    "opt_state": opt_state,
+                    "step": step0 + epoch + 1,
+                }
+            )
+
+        return DeStripe.reconstruct_one_slice(
+            GuidedFilterHRModel,
+            Y_raw,
+            sample_params,
+            slice_data,
+            X,
+            fusion_mask,
+            backend=backend,
+        )
+
+    @staticmethod
+    def train_on_batch_slices(
+        GuidedFilterHRModel,
+        update_method,
+        sample_params: Dict,
+        train_params: Dict,
+        slices: list,
+        s_: list,
+        z: int = 1,
+        backend: str = "jax",
+        warm_state: Dict = None,
+        snapshots: list = None,
+    ):
+        """
+        Train the destriping model on several image slices jointly.
+
+        Every slice keeps its own network parameters and optimizer state,
+        but all of them are updated by one vectorized step per epoch.
+
+        Args:
+            GuidedFilterHRModel: Guided upsampling model.
+            update_method: Update method for optimization.
+            sample_params (dict): Sample-specific parameters.
+            train_params (dict): Training parameters.
+            slices (list): (X, mask, fusion_mask) of every slice in the batch.
+            s_ (list): Indices of the slices in the batch.
+            z (int): Total number of slices.
+            backend (str): Backend to use ('jax' or 'torch').
+            warm_state (dict): If given, every slice of the batch starts from the
+                state stored here, and the state of the last slice is stored back.
+                An optional "n_epochs" entry overrides ``warm_start_n_epochs``,
+                0 runs inference only.
+            snapshots (list): If given, a snapshot of the trained parameters
+                and optimizer state of every slice is appended to it.
+
+        Returns:
+            list: (output image, target image) of every slice in the batch.
+        """
+        slice_data = [
+            DeStripe.prepare_one_slice(
+                update_method,
+                sample_params,
+                train_params,
+                X,
+                mask,
+                fusion_mask,
+                backend=backend,
+            )
+            for X, mask, fusion_mask in slices
+        ]
+        if (
+            (warm_state is not None)
+            and ("net_params" in warm_state)
+            and (warm_state.get("n_epochs", None) == 0)
+        ):
+            # inference only, all slices share the parameters of warm_state
+            return [
+                DeStripe.reconstruct_one_slice(
+                    GuidedFilterHRModel,
+                    update_method.predict(
+                        warm_state["net_params"],
+                        slice_data[k]["aver"],
+                        slice_data[k]["xf"],
+                        slice_data[k]["y"],
+                        slice_data[k]["mask_dict"],
+                        slice_data[k]["hy"],
+                        slice_data[k]["targets_f"],
+                        slice_data[k]["targetd_bilinear"],
+                    ),
+                    sample_params,
+                    slice_data[k],
+                    X,
+                    fusion_mask,
+                    backend=backend,
+                )
+                for k, (X, _, fusion_mask) in enumerate(slices)
+            ]
+        batch_data = stack_slice_data(slice_data, backend)
+        if (warm_state is not None) and ("net_params" in warm_state):
+            net_params, opt_state = update_method.init_batch(
+                warm_state["net_params"],
+                len(slices),
+                warm_state["opt_state"],
+            )
+            step0 = warm_state["step"]
+            n_epochs = warm_state.get("n_epochs", train_params["warm_start_n_epochs"])
+        else:
+            net_params, _ = DeStripe.init_one_slice(
+                update_method,
+                slice_data[0],
+                backend=backend,
+            )
+            net_params, opt_state = update_method.init_batch(net_params, len(slices))
+            step0, n_epochs = 0, train_params["n_epochs"]
+
+        monitor = ConvergenceMonitor(
+            train_params["convergence_tol"],
+            train_params["convergence_window"],
+            train_params["min_n_epochs"],
+        )
+        for epoch in tqdm.tqdm(
+            range(n_epochs),
+            leave=False,
+            desc="for {}-{} ({} slices in total): ".format(s_[0], s_[-1], z),
+        ):
+            l, net_params, opt_state, Y_raw = update_method.batch_call(
+                step0 + epoch,
+                net_params,
+                opt_state,
+                batch_data["aver"],
+                batch_data["xf"],
+                batch_data["y"],
+                batch_data["mask_dict"],
+                batch_data["hy"],
+                batch_data["targets_f"],
+                batch_data["targetd_bilinear"],
+            )
+            if monitor(epoch, l):
+                break
+        if backend == "torch":
+            Y_raw = Y_raw.detach()
+        if snapshots is not None:
+            for k in range(len(slices)):
+                net_params_, opt_state_ = update_method.snapshot(
+                    *update_method.select_batch(net_params, opt_state, k)
+                )
+                snapshots.append(
+                    {
+                        "net_params": net_params_,
+                        "opt_state": opt_state_,
+                        "step": step0 + epoch + 1,
+                    }
+                )
+        if warm_state is not None:
+            net_params, opt_state = update_method.select_batch(
+                net_params, opt_state, -1
+            )
+            warm_state.update(
+                {
+                    "net_params": net_params,
+                    "opt_state": opt_state,
+                    "step": step0 + epoch + 1,
+                }
+            )
+
+        return [
+            DeStripe.reconstruct_one_slice(
+                GuidedFilterHRModel,
+                Y_raw[k],
+                sample_params,
+                slice_data[k],
+                X,
+                fusion_mask,
+                backend=backend,
+            )
+            for k, (X, _, fusion_mask) in enumerate(slices)
+        ]
+
+    @staticmethod
+    def load_one_slice(
+        X: Union[np.ndarray, da.core.Array],
+        mask: Union[np.ndarray, da.core.Array],
+        fusion_mask: Union[np.ndarray, da.core.Array],
+        i: int,
+        m: int,
+        n: int,
+        is_vertical: bool,
+        flag_compose: bool = False,
+        backend: str = "jax",
+        device: str = "cpu",
+    ):
+        """
+        Read the i-th slice of the input volume(s) and move it to the backend.
+
+        Returns:
+            tuple: (input, mask, fusion mask) of the slice.
+        """
+        input = np.log10(np.clip(np.asarray(X[i : i + 1])[:, :, :m, :n], 1, None))
+        mask_slice = np.asarray(mask[i : i + 1, :m, :n])[None]
+        if flag_compose:
+            fusion_mask_slice = np.asarray(fusion_mask[i : i + 1])[:, :, :m, :n]
+        else:
+            fusion_mask_slice = np.ones(input.shape, dtype=np.float32)
+        # pad up to (m, n) when shapes are bucketed
+        pad = ((0, 0), (0, 0), (0, m - input.shape[-2]), (0, n - input.shape[-1]))
+        if pad[-2][1] or pad[-1][1]:
+            input = np.pad(input, pad, mode="symmetric")
+            mask_slice = np.pad(mask_slice, pad)
+            fusion_mask_slice = np.pad(fusion_mask_slice, pad, mode="edge")
+
+        if not is_vertical:
+            input = input.transpose(0, 1, 3, 2)
+            mask_slice = mask_slice.transpose(0, 1, 3, 2)
+            fusion_mask_slice = fusion_mask_slice.transpose(0, 1, 3, 2)
+        if backend == "jax":
+            input = jnp.asarray(input)
+            mask_slice = jnp.asarray(mask_slice)
+            fusion_mask_slice = jnp.asarray(fusion_mask_slice)
+        else:
+            input = torch.from_numpy(input).to(device)
+            mask_slice = torch.from_numpy(mask_slice).to(device)
+            fusion_mask_slice = torch.from_numpy(fusion_mask_slice).to(device)
+        return input, mask_slice, fusion_mask_slice
+
+    @staticmethod
+    def build_pipeline(
+        train_params: Dict,
+        sample_params: Dict,
+        backend: str = "jax",
+        device: str = "cpu",
+    ):
+        """
+        Build the models shared by all slices of a volume.
+
+        Args:
+            train_params (dict): Training parameters.
+            sample_params (dict): Sample-specific parameters.
+            backend (str): Backend to use ('jax' or 'torch').
+            device (str): Device to use.
+
+        Returns:
+            tuple: (guided upsampling model, update method)
+        """
+        cache_dir = (
+            default_cache_dir()
+            if train_params["cache_dir"] is None
+            else train_params["cache_dir"]
+        )
+        if (backend == "jax") and cache_dir:
+            enable_compilation_cache(os.path.join(cache_dir, "jax"))
+        r = sample_params["r"]
+        hier_mask_arr, hier_ind_arr, NI_arr = prepare_aux(
+            sample_params["md"],
+            sample_params["nd"],
+            sample_params["is_vertical"],
+            np.rad2deg(
+                np.arctan(r * np.tan(np.deg2rad(sample_params["angle_offset"])))
+            ),
+            train_params["wedge_degree"],
+            train_params["n_neighbors"],
+            backend=backend,
+            cache_dir=train_params["cache_dir"],
+        )
+        GuidedFilterHRModel = GuidedUpsample(
+            rx=train_params["gf_kernel_size"],
+            device=device,
+        )
+
+        network = transform_cmplx_model(
+            model=DeStripeModel_jax if backend == "jax" else DeStripeModel_torch,
+            inc=train_params["inc"],
+            m_l=(
+                sample_params["md"]
+                if sample_params["is_vertical"]
+                else sample_params["nd"]
+            ),
+            n_l=(
+                sample_params["nd"]
+                if sample_params["is_vertical"]
+                else sample_params["md"]
+            ),
+            Angle=sample_params["angle_offset"],
+            NI=NI_arr,
+            hier_mask=hier_mask_arr,
+            hier_ind=hier_ind_arr,
+            r=sample_params["r"],
+            cache_dir=train_params["cache_dir"],
+            backend=backend,
+            device=device,
+        )
+
+        if backend == "jax":
+            update_method = update_jax(
+                network,
+                Loss_jax(train_params, sample_params),
+                0.01,
+            )
+        else:
+            update_method = update_torch(
+                network,
+                Loss_torch(train_params, sample_params).to(device),
+                0.01,
+                compile=train_params["torch_compile"],
+            )
+
+        return GuidedFilterHRModel, update_method
+
+    @staticmethod
+    def destripe_slices(
+        inds: list,
+        X: Union[np.ndarray, da.core.Array],
+        mask: Union[np.ndarray, da.core.Array],
+        fusion_mask: Union[np.ndarray, da.core.Array],
+        GuidedFilterHRModel,
+        update_method,
+        sample_params: Dict,
+        train_params: Dict,
+        flag_compose: bool = False,
+        backend: str = "jax",
+        device: str = "cpu",
+        warm_state: Dict = None,
+        slices: list = None,
+        snapshots: list = None,
+    ):
+        """
+        Load and destripe a batch of slices.
+
+        Args:
+            inds (list): Indices of the slices, trained jointly if more than one.
+            slices (list): The slices as given by ``load_slices``, if already loaded.
+            snapshots (list): If given, the trained state of every slice is appended to it.
+            (see ``train_on_full_arr`` and ``train_on_one_slice`` for the others)
+
+        Returns:
+            list: (output image, target image) of every slice, in the image space of ``X``.
+        """
+        z = X.shape[0]
+        if slices is None:
+            slices = DeStripe.load_slices(
+                inds,
+                X,
+                mask,
+                fusion_mask,
+                sample_params,
+                flag_compose=flag_compose,
+                backend=backend,
+                device=device,
+            )
+
+        if len(inds) == 1:
+            outputs = [
+                DeStripe.train_on_one_slice(
+                    GuidedFilterHRModel,
+                    update_method,
+                    sample_params,
+                    train_params,
+                    *slices[0],
+                    inds[0] + 1,
+                    z,
+                    backend=backend,
+                    warm_state=warm_state,
+                    snapshots=snapshots,
+                )
+            ]
+        else:
+            outputs = DeStripe.train_on_batch_slices(
+                GuidedFilterHRModel,
+                update_method,
+                sample_params,
+                train_params,
+                slices,
+                [i + 1 for i in inds],
+                z,
+                backend=backend,
+                warm_state=warm_state,
+                snapshots=snapshots,
+            )
+        if not sample_params["is_vertical"]:
+            outputs = [(Y.T, target.T) for Y, target in outputs]
+        return outputs
+
+    @staticmethod
+    def load_slices(
+        inds: list,
+        X: Union[np.ndarray, da.core.Array],
+        mask: Union[np.ndarray, da.core.Array],
+        fusion_mask: Union[np.ndarray, da.core.Array],
+        sample_params: Dict,
+        flag_compose: bool = False,
+        backend: str = "jax",
+        device: str = "cpu",
+    ):
+        """
+        Load a batch of slices with ``load_one_slice``.
+
+        Returns:
+            list: (input, mask, fusion mask) of every slice.
+        """
+        return [
+            DeStripe.load_one_slice(
+                X,
+                mask,
+                fusion_mask,
+                i,
+                sample_params["m"],
+                sample_params["n"],
+                sample_params["is_vertical"],
+                flag_compose=flag_compose,
+                backend=backend,
+                device=device,
+            )
+            for i in inds
+        ]
+
+    @staticmethod
+    def destripe_slices_parallel(
+        batches: list,
+        worker_args: Dict,
+        n_workers: int,
+        n_threads_per_worker: int = None,
+        n_prefetch: int = 1,
+    ):
+        """
+        Destripe batches of slices in a pool of worker processes.
+
+        Every worker builds its own pipeline once, then takes batches of slice
+        indices from the pool's task queue and writes the results directly into
+        the work memmap at ``worker_args["result_path"]``.
+
+        Yields:
+            tuple: (slice index, (mean, min, max) of the written slice)
+        """
+        if n_threads_per_worker is None:
+            n_threads_per_worker = max(1, (os.cpu_count() or 1) // n_workers)
+        ctx = multiprocessing.get_context("spawn")
+        with limit_threads_env(n_threads_per_worker):
+            pool = ctx.Pool(
+                n_workers,
+                initializer=_init_slice_worker,
+                initargs=(worker_args, n_threads_per_worker),
+            )
+        with pool:
+            for results in pool.imap_unordered(_run_slice_worker, batches):
+                yield from results
+
     @staticmethod
     def train_on_full_arr(
         X: Union[np.ndarray, da.core.Array],
@@ -375,6 +1089,8 @@ class DeStripe:
         display_angle_orientation: bool = True,
         illu_orient: str = None,
         save_path: str = None,
+        resume: bool = False,
+        pipelines: Dict = None,
     ):
         """
         Train the destriping model on a full 3D array (volume).
@@ -396,6 +1112,13 @@ class DeStripe:
             flag_compose (bool): Whether to compose multiple inputs.
             display_angle_orientation (bool): Whether to display angle orientation.
             illu_orient (str): Illumination orientation.
+            save_path (str): Path of the output .tif file. Intermediate results are
+                kept in memmaps next to it.
+            resume (bool): Whether to continue an interrupted run with the same ``save_path``,
+                skipping slices that are already finished.
+            pipelines (dict): If given, the models of ``build_pipeline`` are looked up
+                in (and added to) it by the geometry of the volume, so that volumes of
+                the same shape and angle offsets share them.
 
         Returns:
             np.ndarray: The destriped output volume.
@@ -438,19 +1161,45 @@ class DeStripe:
             "non_positive": non_positive,
             "allow_stripe_deviation": allow_stripe_deviation,
             "illu_orient": illu_orient_new,
+            "post_n_epochs": train_params["post_n_epochs"],
+            "post_n_epochs_compose": train_params["post_n_epochs_compose"],
+            "post_solver": {
+                "tol": train_params["post_convergence_tol"],
+                "window": train_params["convergence_window"],
+                "min_epochs": train_params["min_n_epochs"],
+                "timings": {},
+            },
         }
         z, _, m, n = X.shape
         _, _, m_0, n_0 = X.shape
         if save_path is not None:
             base, stem = ensure_abs_tif(save_path)
-            result_mm, done_mm = open_or_init_mm(base, stem, z, m, n)
+            result_mm, done_mm, stats_mm = open_or_init_mm(
+                base, stem, z, m, n, resume=resume
+            )
         else:
             result_mm = np.zeros((z, m, n), dtype=np.uint16)
             done_mm = np.zeros(z, dtype=np.uint8)
+            stats_mm = np.zeros((z, 3), dtype=np.float64)
 
-        mean = np.zeros(z, dtype=np.float64)
-        MIN = np.zeros(z, dtype=np.float64)
-        MAX = np.zeros(z, dtype=np.float64)
+        # per-slice statistics for global_correction, kept on disk to allow resuming
+        mean, MIN, MAX = stats_mm[:, 0], stats_mm[:, 1], stats_mm[:, 2]
+
+        # equal-width tiles perpendicular to the stripes share one pipeline
+        tile_axis = -1 if sample_params["is_vertical"] else -2
+        tiles = tile_offsets(
+            X.shape[tile_axis],
+            train_params["tile_size"],
+            train_params["tile_overlap"],
+        )
+        if tiles is not None:
+            if sample_params["is_vertical"]:
+                n = train_params["tile_size"]
+            else:
+                m = train_params["tile_size"]
+        # slices are padded up to the bucketed size when loaded
+        m = bucket_size(m, train_params["shape_bucket"])
+        n = bucket_size(n, train_params["shape_bucket"])
 
         if sample_params["is_vertical"]:
             n = n if n % 2 == 1 else n - 1
@@ -476,17 +1225,6 @@ class DeStripe:
                 n // train_params["resample_ratio"],
             )
 
-        hier_mask_arr, hier_ind_arr, NI_arr = prepare_aux(
-            sample_params["md"],
-            sample_params["nd"],
-            sample_params["is_vertical"],
-            np.rad2deg(
-                np.arctan(r * np.tan(np.deg2rad(sample_params["angle_offset"])))
-            ),
-            train_params["wedge_degree"],
-            train_params["n_neighbors"],
-            backend=backend,
-        )
         if display_angle_orientation:
             print("Please check the orientation of the stripes...")
             fig, ax = plt.subplots(
@@ -512,33 +1250,6 @@ class DeStripe:
                 ax[i].axis("off")
             plt.show()
 
-        GuidedFilterHRModel = GuidedUpsample(
-            rx=train_params["gf_kernel_size"],
-            device=device,
-        )
-
-        network = transform_cmplx_model(
-            model=DeStripeModel_jax if backend == "jax" else DeStripeModel_torch,
-            inc=train_params["inc"],
-            m_l=(
-                sample_params["md"]
-                if sample_params["is_vertical"]
-                else sample_params["nd"]
-            ),
-            n_l=(
-                sample_params["nd"]
-                if sample_params["is_vertical"]
-                else sample_params["md"]
-            ),
-            Angle=sample_params["angle_offset"],
-            NI=NI_arr,
-            hier_mask=hier_mask_arr,
-            hier_ind=hier_ind_arr,
-            r=sample_params["r"],
-            backend=backend,
-            device=device,
-        )
-
         train_params.update(
             {
                 "max_pool_kernel_size": (
@@ -546,86 +1257,187 @@ class DeStripe:
                 )
             }
         )
-        if backend == "jax":
-            update_method = update_jax(
-                network,
-                Loss_jax(train_params, sample_params),
-                0.01,
-            )
+
+        n_workers = max(1, int(train_params["n_workers"]))
+        if (n_workers > 1) and (save_path is None):
+            print("n_workers > 1 requires save_path, use a single process instead.")
+            n_workers = 1
+        if (n_workers > 1) and (tiles is not None):
+            print("tiled destriping runs in a single process, n_workers is ignored.")
+            n_workers = 1
+        keyframe_interval = max(1, int(train_params["keyframe_interval"]))
+        if (keyframe_interval > 1) and (n_workers > 1):
+            print("keyframe_interval is ignored for n_workers > 1.")
+            keyframe_interval = 1
+
+        batch_size = max(1, int(train_params["batch_size"]))
+        todo = [i for i in range(z) if not done_mm[i]]
+        if keyframe_interval > 1:
+            # keyframes first, then the slices in between, batched per keyframe
+            keyframes, followers = keyframe_schedule(z, keyframe_interval, done_mm)
+            batches = [
+                keyframes[i0 : i0 + batch_size]
+                for i0 in range(0, len(keyframes), batch_size)
+            ]
+            for inds in followers.values():
+                batches += [
+                    inds[i0 : i0 + batch_size] for i0 in range(0, len(inds), batch_size)
+                ]
+            keyframe_of = {i: k for k, inds in followers.items() for i in inds}
         else:
-            update_method = update_torch(
-                network,
-                Loss_torch(train_params, sample_params).to(device),
-                0.01,
+            batches = [
+                todo[i0 : i0 + batch_size] for i0 in range(0, len(todo), batch_size)
+            ]
+            keyframe_of = {}
+        keyframe_states = {}
+
+        if n_workers > 1:
+            worker_args = {
+                "X": as_picklable(X),
+                "mask": as_picklable(mask),
+                "fusion_mask": as_picklable(fusion_mask),
+                "result_path": str(result_mm.filename),
+                "train_params": train_params,
+                "sample_params": sample_params,
+                "flag_compose": flag_compose,
+                "backend": backend,
+                "device": device,
+            }
+            for i, stats in tqdm.tqdm(
+                DeStripe.destripe_slices_parallel(
+                    batches,
+                    worker_args,
+                    n_workers,
+                    train_params["n_threads_per_worker"],
+                ),
+                total=len(todo),
+                desc="destriping with {} workers: ".format(n_workers),
+            ):
+                stats_mm[i] = stats
+                done_mm[i] = 1
+                getattr(stats_mm, "flush", lambda: None)()
+                getattr(done_mm, "flush", lambda: None)()
+            getattr(result_mm, "flush", lambda: None)()
+        else:
+            pipeline_key = (
+                sample_params["m"],
+                sample_params["n"],
+                sample_params["is_vertical"],
+                tuple(sample_params["angle_offset"]),
+                backend,
+                str(device),
             )
-
-        for i in range(z):
-            input = np.log10(np.clip(np.asarray(X[i : i + 1])[:, :, :m, :n], 1, None))
-            mask_slice = np.asarray(mask[i : i + 1, :m, :n])[None]
-            if flag_compose:
-                fusion_mask_slice = np.asarray(fusion_mask[i : i + 1])[:, :, :m, :n]
+            if (pipelines is not None) and (pipeline_key in pipelines):
+                GuidedFilterHRModel, update_method = pipelines[pipeline_key]
             else:
-                fusion_mask_slice = np.ones(input.shape, dtype=np.float32)
-
-            if not sample_params["is_vertical"]:
-                input = input.transpose(0, 1, 3, 2)
-                mask_slice = mask_slice.transpose(0, 1, 3, 2)
-                fusion_mask_slice = fusion_mask_slice.transpose(0, 1, 3, 2)
-            if backend == "jax":
-                input = jnp.asarray(input)
-                mask_slice = jnp.asarray(mask_slice)
-                fusion_mask_slice = jnp.asarray(fusion_mask_slice)
-            else:
-                input = torch.from_numpy(input).to(device)
-                mask_slice = torch.from_numpy(mask_slice).to(device)
-                fusion_mask_slice = torch.from_numpy(fusion_mask_slice).to(device)
-
-            Y, target = DeStripe.train_on_one_slice(
-                GuidedFilterHRModel,
-                update_method,
-                sample_params,
-                train_params,
-                input,
-                mask_slice,
-                fusion_mask_slice,
-                i + 1,
-                z,
-                backend=backend,
-            )
-
-            if not sample_params["is_vertical"]:
-                Y = Y.T
-                target = target.T
-
-            if display:
-                plt.figure(dpi=300)
-                ax = plt.subplot(1, 2, 2)
-                plt.imshow(Y, vmin=Y.min(), vmax=Y.max(), cmap="gray")
-                ax.set_title("output", fontsize=8, pad=1)
-                plt.axis("off")
-                ax = plt.subplot(1, 2, 1)
-                plt.imshow(target, vmin=Y.min(), vmax=Y.max(), cmap="gray")
-                ax.set_title("input", fontsize=8, pad=1)
-                plt.axis("off")
-                plt.show()
+                GuidedFilterHRModel, update_method = DeStripe.build_pipeline(
+                    train_params,
+                    sample_params,
+                    backend=backend,
+                    device=device,
+                )
+                if pipelines is not None:
+                    pipelines[pipeline_key] = (GuidedFilterHRModel, update_method)
 
-            out_slice = np.clip(Y, 0, 65535).astype(np.uint16)
-            out_slice = np.pad(
-                out_slice,
-                ((0, m_0 - m), (0, n_0 - n)),
-                mode="edge",
+            tiles_ = [None] if tiles is None else tiles
+            # one warm start chain per tile
+            warm_states = {
+                t0: ({} if train_params["warm_start"] else None) for t0 in tiles_
+            }
+            if tiles is not None:
+                blender = TileBlender(
+                    (m_0, n_0),
+                    tiles,
+                    train_params["tile_size"],
+                    train_params["tile_overlap"],
+                    tile_axis,
+                )
+            # read the next slices from disk while the current ones are trained
+            loader = SlicePrefetcher(
+                lambda item: DeStripe.load_slices(
+                    item[0],
+                    tile_view(X, item[1], train_params["tile_size"], tile_axis),
+                    tile_view(mask, item[1], train_params["tile_size"], tile_axis),
+                    tile_view(
+                        fusion_mask, item[1], train_params["tile_size"], tile_axis
+                    ),
+                    sample_params,
+                    flag_compose=flag_compose,
+                    backend=backend,
+                    device=device,
+                ),
+                [(inds, t0) for inds in batches for t0 in tiles_],
+                depth=train_params["n_prefetch"],
             )
-
-            result_mm[i] = out_slice
-            MIN[i] = out_slice.min()
-            MAX[i] = out_slice.max()
-            mean[i] = np.mean(out_slice + 0.1)
-            done_mm[i] = 1
-
-            getattr(result_mm, "flush", lambda: None)()
-            getattr(done_mm, "flush", lambda: None)()
-
-        if (z != 1) and (not sample_params["non_positive"]):
+            for (inds, t0), slices in loader:
+                if inds[0] in keyframe_of:
+                    keyframe_state = keyframe_states[(keyframe_of[inds[0]], t0)]
+                    net_params, opt_state = update_method.restore(
+                        (
+                            keyframe_state["net_params"],
+                            keyframe_state["opt_state"],
+                        )
+                    )
+                    slice_state = {
+                        "net_params": net_params,
+                        "opt_state": opt_state,
+                        "step": keyframe_state["step"],
+                        "n_epochs": train_params["keyframe_n_epochs"],
+                    }
+                    snapshots = None
+                else:
+                    slice_state = warm_states[t0]
+                    snapshots = [] if keyframe_interval > 1 else None
+                outputs = DeStripe.destripe_slices(
+                    inds,
+                    X,
+                    mask,
+                    fusion_mask,
+                    GuidedFilterHRModel,
+                    update_method,
+                    sample_params,
+                    train_params,
+                    flag_compose=flag_compose,
+                    backend=backend,
+                    device=device,
+                    warm_state=slice_state,
+                    slices=slices,
+                    snapshots=snapshots,
+                )
+                if snapshots is not None:
+                    keyframe_states.update(zip([(i, t0) for i in inds], snapshots))
+                if tiles is not None:
+                    outputs = [
+                        blender.add(i, t0, Y, target)
+                        for i, (Y, target) in zip(inds, outputs)
+                    ]
+                    inds = [i for i, out in zip(inds, outputs) if out is not None]
+                    outputs = [out for out in outputs if out is not None]
+
+                for i, (Y, target) in zip(inds, outputs):
+                    if display:
+                        plt.figure(dpi=300)
+                        ax = plt.subplot(1, 2, 2)
+                        plt.imshow(Y, vmin=Y.min(), vmax=Y.max(), cmap="gray")
+                        ax.set_title("output", fontsize=8, pad=1)
+                        plt.axis("off")
+                        ax = plt.subplot(1, 2, 1)
+                        plt.imshow(target, vmin=Y.min(), vmax=Y.max(), cmap="gray")
+                        ax.set_title("input", fontsize=8, pad=1)
+                        plt.axis("off")
+                        plt.show()
+
+                    out_slice = to_output_slice(Y, m_0, n_0)
+
+                    result_mm[i] = out_slice
+                    stats_mm[i] = slice_stats(out_slice)
+                    done_mm[i] = 1
+
+                    getattr(result_mm, "flush", lambda: None)()
+                    getattr(stats_mm, "flush", lambda: None)()
+                    getattr(done_mm, "flush", lambda: None)()
+
+        if (z != 1) and (not sample_params["non_positive"]) and (save_path is None):
             print("global correcting...")
             global_correction(
                 mean,
@@ -633,6 +1445,22 @@ class DeStripe:
                 MIN,
                 MAX,
             )
+        # with save_path, global correction is applied by finalize_save
+        # while the result is streamed to disk
+        for name, (n_runs, n_epochs, t) in sample_params["post_solver"][
+            "timings"
+        ].items():
+            print(
+                "post-processing ({}): {} runs, {:.0f} epochs per run, {:.1f} s".format(
+                    name, n_runs, n_epochs / n_runs, t
+                )
+            )
+        if os.environ.get("LEONARDO_DEBUG"):
+            print(
+                "JAX/torch handoffs: {dlpack} zero-copy, {copy} copied".format(
+                    **interop_copies
+                )
+            )
         print("Done")
         return result_mm
 
@@ -649,6 +1477,13 @@ class DeStripe:
         display_angle_orientation: bool = False,
         non_positive: bool = False,
         allow_stripe_deviation: bool = False,
+        resume: bool = False,
+        compression: str = None,
+        compression_threads: int = None,
+        preview_slices: list[int] = None,
+        preview_downsample: int = 4,
+        preview_n_epochs: int = 30,
+        pipelines: Dict = None,
         **kwargs,
     ):
         """
@@ -681,11 +1516,34 @@ class DeStripe:
                 Whether to display check for angle orientation.
             non_positive : bool
                 Whether the stripes are non-positive only.
+            resume : bool
+                Whether to continue an interrupted run with the same ``save_path``.
+                Slices already finished are read back from the work files next to
+                ``save_path`` instead of being destriped again.
+            compression : str, optional
+                Compression of the saved .tif file, e.g. ``"zlib"`` or ``"zstd"``.
+                The result is streamed to disk slice by slice in any case.
+            compression_threads : int, optional
+                Number of threads used to compress each slice.
+            preview_slices : list[int], optional
+                If given, only these slices are destriped, as a quick preview for
+                tuning ``angle_offset``, ``wedge_degree`` and the lambda weights.
+                The slices are downsampled in XY by ``preview_downsample`` and trained
+                for ``preview_n_epochs`` epochs, post-processing is skipped, and nothing
+                is written to ``save_path``.
+            preview_downsample : int, optional
+                Downsampling factor in XY of the preview.
+            preview_n_epochs : int, optional
+                Number of epochs per slice of the preview.
+            pipelines : dict, optional
+                Models built by earlier calls, reused if the geometry matches
+                (see ``train_many``).
             **kwargs
                 Additional keyword arguments for advanced workflows.
 
         Returns:
-            np.ndarray: The destriped output image or volume.
+            np.ndarray: The destriped output image or volume
+            (the downsampled ``preview_slices`` in preview mode).
 
         .. note::
 
@@ -794,13 +1652,14 @@ class DeStripe:
 
         # read in mask
         if mask is None:
-            mask_data = np.zeros((z, m, n), dtype=bool)
+            mask_data = da.zeros((z, m, n), dtype=bool, chunks=(1, m, n))
         else:
             mask_handle = BioImage(mask)
             mask_data = mask_handle.get_image_dask_data("ZYX", T=0, C=0)
             assert mask_data.shape == (z, m, n), print(
                 "mask should be of same shape as input volume(s)."
             )
+        out = None
         # read in dual-result, if applicable
 
         try:
@@ -867,13 +1726,27 @@ class DeStripe:
                         else:
                             is_vertical = is_vertical_illu
 
+            train_params = self.train_params
+            if preview_slices is not None:
+                X, mask_data, fusion_mask, train_params = self.preview_inputs(
+                    preview_slices,
+                    X,
+                    mask_data,
+                    fusion_mask if flag_compose else None,
+                    train_params,
+                    preview_downsample,
+                    preview_n_epochs,
+                )
+                illu_orient = []
+                save_path = None
+
             # training
             out = self.train_on_full_arr(
                 X,
                 is_vertical,
                 angle_offset_dict,
                 mask_data,
-                self.train_params,
+                train_params,
                 fusion_mask,
                 display=display,
                 device=self.device,
@@ -884,8 +1757,9 @@ class DeStripe:
                 display_angle_orientation=display_angle_orientation,
                 illu_orient=illu_orient,
                 save_path=save_path,
+                resume=resume,
+                pipelines=pipelines,
             )
-            return out
         except Exception as e:
             traceback.print_exc()
             print(e)
@@ -906,6 +1780,165 @@ class DeStripe:
                         os.path.join(base, f"{stem}__work.npy"),
                         os.path.join(base, f"{stem}__done.npy"),
                         save_path,
+                        compression=compression,
+                        maxworkers=compression_threads,
+                        correct=not non_positive,
                     )
             except:
                 pass
+        if (out is not None) and (save_path is not None):
+            # the work memmap is gone, hand back the (corrected) saved volume
+            out = BioImage(save_path).get_image_dask_data("ZYX", T=0, C=0)
+        return out
+
+    def train_many(
+        self,
+        save_path: list[str] = None,
+        is_vertical: bool = None,
+        x: list[Union[str, np.ndarray, Array]] = None,
+        mask: list[Union[str, np.ndarray, Array]] = None,
+        illu_orient: str = None,
+        angle_offset: list[float] = None,
+        **kwargs,
+    ):
+        """
+        Destripe several volumes (e.g. tiles or channels) sharing the same
+        shape and angle configuration, one after the other.
+
+        The wedge masks, neighbour graphs, network, loss and guided upsampling
+        model are built for the first volume and reused by every following one
+        of the same geometry, so that (compiled) pipelines are not rebuilt.
+        Every volume keeps its own output and global correction.
+
+        Args:
+            save_path : list[str], optional
+                Output .tif path of every volume. If not given, the results are
+                only returned.
+            x : list
+                Input arrays or paths, in (Z, X, Y) format.
+            mask : list, optional
+                Mask of every volume, see ``train``.
+            is_vertical, illu_orient, angle_offset, **kwargs
+                Shared by all volumes, see ``train``.
+
+        Returns:
+            list: The destriped output of every volume.
+        """
+        if save_path is None:
+            save_path = [None] * len(x)
+        if mask is None:
+            mask = [None] * len(x)
+        assert len(save_path) == len(x), print(
+            "save_path should be {} in total.".format(len(x))
+        )
+        assert len(mask) == len(x), print("mask should be {} in total.".format(len(x)))
+        named = [p for p in save_path if p is not None]
+        assert len(set(named)) == len(named), print("save_path should be unique.")
+
+        pipelines = {}
+        out = []
+        for i, (x_i, mask_i, save_path_i) in enumerate(zip(x, mask, save_path)):
+            print("volume {} of {}".format(i + 1, len(x)))
+            out.append(
+                self.train(
+                    save_path=save_path_i,
+                    is_vertical=is_vertical,
+                    x=x_i,
+                    mask=mask_i,
+                    illu_orient=illu_orient,
+                    angle_offset=angle_offset,
+                    pipelines=pipelines,
+                    **kwargs,
+                )
+            )
+        return out
+
+    @staticmethod
+    def preview_inputs(
+        inds: list,
+        X: Union[np.ndarray, da.core.Array],
+        mask: Union[np.ndarray, da.core.Array],
+        fusion_mask: Union[np.ndarray, da.core.Array],
+        train_params: Dict,
+        downsample: int = 4,
+        n_epochs: int = 30,
+    ):
+        """
+        Reduce the inputs and training parameters to a quick preview of
+        the slices ``inds``, downsampled in XY by ``downsample``.
+
+        Returns:
+            tuple: (input, mask, fusion mask, training parameters) of the preview.
+        """
+        downsample = max(1, int(downsample))
+        X = preview_view(X, inds, downsample)
+        mask = preview_view(mask, inds, downsample, reduce=np.max)
+        fusion_mask = preview_view(fusion_mask, inds, downsample)
+        train_params = dict(train_params)
+        gf_kernel_size = train_params["gf_kernel_size"] // downsample
+        train_params.update(
+            {
+                "n_epochs": n_epochs,
+                "warm_start_n_epochs": min(
+                    train_params["warm_start_n_epochs"], n_epochs
+                ),
+                "min_n_epochs": min(train_params["min_n_epochs"], n_epochs),
+                "gf_kernel_size": max(3, gf_kernel_size // 2 * 2 + 1),
+                "n_workers": 1,
+                "keyframe_interval": 1,
+                "tile_size": None,
+            }
+        )
+        print(
+            "preview of {} slices at {}x{}, {} epochs, without post-processing".format(
+                X.shape[0], X.shape[-2], X.shape[-1], n_epochs
+            )
+        )
+        return X, mask, fusion_mask, train_params
+
+
+_slice_worker_state = {}
+
+
+def _init_slice_worker(worker_args, n_threads):
+    torch.set_num_threads(n_threads)
+    state = dict(worker_args)
+    for key in ["X", "mask", "fusion_mask"]:
+        state[key] = from_picklable(state[key])
+    state["result_mm"] = np.lib.format.open_memmap(
+        worker_args["result_path"], mode="r+"
+    )
+    state["GuidedFilterHRModel"], state["update_method"] = DeStripe.build_pipeline(
+        state["train_params"],
+        state["sample_params"],
+        backend=state["backend"],
+        device=state["device"],
+    )
+    state["warm_state"] = {} if state["train_params"]["warm_start"] else None
+    _slice_worker_state.update(state)
+
+
+def _run_slice_worker(inds):
+    state = _slice_worker_state
+    outputs = DeStripe.destripe_slices(
+        inds,
+        state["X"],
+        state["mask"],
+        state["fusion_mask"],
+        state["GuidedFilterHRModel"],
+        state["update_method"],
+        state["sample_params"],
+        state["train_params"],
+        flag_compose=state["flag_compose"],
+        backend=state["backend"],
+        device=state["device"],
+        warm_state=state["warm_state"],
+    )
+    result_mm = state["result_mm"]
+    results = []
+    for i, (Y, _) in zip(inds, outputs):
+        out_slice = to_output_slice(Y, *result_mm.shape[-2:])
+        result_mm[i] = out_slice
+        results.append((i, slice_stats(out_slice)))
+    result_mm.flush()
+    return results
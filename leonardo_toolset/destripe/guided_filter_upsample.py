@@ -7,6 +7,7 @@ import torch
 import torch.nn.functional as F
 
 from leonardo_toolset.destripe.constant import WaveletDetailTuple2d
+from leonardo_toolset.destripe.utils import jax_to_torch
 
 try:
     import jax
@@ -87,6 +88,42 @@ def wave_rec(
     return recon
 
 
+def oriented_median(
+    b,
+    lval,
+    max_elements=2**24,
+):
+    """
+    Median of ``b`` along an oriented line, for every pixel.
+
+    The line of pixel (i, j) runs over rows i - rx // 2, ..., i + rx // 2,
+    shifted horizontally by ``lval``. ``b`` is padded once, and the sheared
+    windows are strided views of the padded array. They are only stacked for
+    a band of rows at a time, so that at most ``max_elements`` values are
+    held in memory, on the device of ``b``.
+    """
+    rx = len(lval)
+    _, _, m, n = b.shape
+    p = int(lval.max())
+    data = F.pad(b, (p, p, rx // 2, rx // 2), "reflect")
+    cols = (lval - lval.min()).tolist()
+    rows = max(1, max_elements // max(1, rx * b.shape[0] * b.shape[1] * n))
+    out = torch.empty_like(b)
+    for r0 in range(0, m, rows):
+        r1 = min(m, r0 + rows)
+        out[:, :, r0:r1] = torch.median(
+            torch.stack(
+                [
+                    data[:, :, r0 + k : r1 + k, c : c + n]
+                    for k, c in enumerate(cols)
+                ],
+                0,
+            ),
+            0,
+        )[0]
+    return out
+
+
 class GuidedUpsample:
     def __init__(
         self,
@@ -114,8 +151,8 @@ class GuidedUpsample:
                 )[None, None]
                 + target
             )
-            recon = torch.from_numpy(np.array(recon, copy=True)).to(self.device)
-            hX = torch.from_numpy(np.array(hX)).to(self.device)
+            recon = jax_to_torch(recon, self.device)
+            hX = jax_to_torch(hX, self.device)
             fusion_mask = np.asarray(fusion_mask)
         else:
             recon = (
@@ -162,15 +199,7 @@ class GuidedUpsample:
             rx = self.rx  # // 3 // 2 * 2 + 1
             lval = np.arange(rx) - rx // 2
             lval = np.round(lval * np.tan(np.deg2rad(-Angle))).astype(np.int32)
-            b_batch = torch.zeros(rx, 1, 1, m, n)
-            for ind, r in enumerate(range(rx)):
-                data = F.pad(b, (lval.max(), lval.max(), rx // 2, rx // 2), "reflect")
-                b_batch[ind] = data[
-                    :, :, r : r + m, lval[ind] - lval.min() : lval[ind] - lval.min() + n
-                ].cpu()
-            b = torch.median(b_batch, 0)[0]
-
-            b = b.to(self.device)
+            b = oriented_median(b, lval)
             hX = hX + b
 
         hX_base = F.avg_pool2d(F.pad(hX, (4, 4, 4, 4), "reflect"), 9, 1, 0)
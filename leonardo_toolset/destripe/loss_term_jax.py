@@ -210,6 +210,16 @@ class Loss_jax:
 
         self.GF_pad = train_params["max_pool_kernel_size"]
 
+        # kernels applied to the same input are stacked into one convolution
+        self.D_tv = jnp.concatenate((self.Dx, self.Dy), 0)
+        self.D_tv_f = jnp.concatenate((self.Dx_f, self.Dy_f), 0)
+        self.D_hessian = jnp.concatenate(
+            (self.DGaussxx, self.DGaussyy, self.DGaussxy), 0
+        )
+        self.D_hessian_f = jnp.concatenate(
+            (self.DGaussxx_f, self.DGaussyy_f, self.DGaussxy_f), 0
+        )
+
         self.total_variation_cal = (
             self.TotalVariationLoss
             if len(self.angleOffset) > 1
@@ -229,14 +239,40 @@ class Loss_jax:
         self.non_postive_uint = identical_unit
         self.main_loss = self.gf_loss
 
-    def gf_loss(self, targets, outputGNNraw_original):
+    def gf_loss(self, gf_target, outputGNNraw_original):
         return 10 * jnp.sum(
             jnp.abs(
-                self.GuidedFilterLoss(targets, targets)
+                gf_target
                 - self.GuidedFilterLoss(outputGNNraw_original, outputGNNraw_original)
             )
         )
 
+    @partial(jit, static_argnums=(0,))
+    def target_terms(
+        self,
+        targets,
+        targets_f,
+    ):
+        """
+        Terms of the loss that only depend on the targets of a slice. They are
+        computed once per slice and passed in with mask_dict.
+        """
+        A = len(self.angleOffset)
+        return {
+            "gf_target": self.GuidedFilterLoss(targets, targets),
+            "target_tv": self.filter(targets, self.D_tv[A:], self.p_tv),
+            "target_tv_f": self.filter(targets_f, self.D_tv_f[A:], self.p_tv),
+            "target_hessian": self.filter(targets, self.D_hessian[A:], self.p_hessian),
+            "target_hessian_f": self.filter(
+                targets_f, self.D_hessian_f[A:], self.p_hessian
+            ),
+        }
+
+    def filter(self, x, D, p):
+        return jax.lax.conv_general_dilated(
+            jnp.pad(x, p, "reflect"), D, (1, 1), "VALID"
+        )
+
     def total_variation_kernel(
         self,
         angle_list,
@@ -270,7 +306,7 @@ class Loss_jax:
 
         md = shape_params["md"] if shape_params["is_vertical"] else shape_params["nd"]
         nd = shape_params["nd"] if shape_params["is_vertical"] else shape_params["md"]
-        gxFFT2, gyFFT2 = jnp.fft.fft2(gx, (md, nd)), jnp.fft.fft2(gy, (md, nd))
+        gxFFT2, gyFFT2 = jnp.fft.rfft2(gx, (md, nd)), jnp.fft.rfft2(gy, (md, nd))
         DGaussxx = jnp.zeros((len(angleOffset), 1, KernelSize, KernelSize))
         DGaussxy = jnp.zeros((len(angleOffset), 1, KernelSize, KernelSize))
         DGaussyy = jnp.zeros((len(angleOffset), 1, KernelSize, KernelSize))
@@ -282,19 +318,19 @@ class Loss_jax:
                 math.sin(-A / 180 * math.pi + math.pi / 2),
             )
             DGaussxx = DGaussxx.at[i : i + 1].set(
-                jnp.fft.ifft2(
-                    (a * gxFFT2 + b * gyFFT2) * (a * gxFFT2 + b * gyFFT2), axes=(-2, -1)
-                ).real[None, None, :KernelSize, :KernelSize]
+                jnp.fft.irfft2(
+                    (a * gxFFT2 + b * gyFFT2) * (a * gxFFT2 + b * gyFFT2), (md, nd)
+                )[None, None, :KernelSize, :KernelSize]
             )
             DGaussyy = DGaussyy.at[i : i + 1].set(
-                jnp.fft.ifft2(
-                    (c * gxFFT2 + d * gyFFT2) * (c * gxFFT2 + d * gyFFT2), axes=(-2, -1)
-                ).real[None, None, :KernelSize, :KernelSize]
+                jnp.fft.irfft2(
+                    (c * gxFFT2 + d * gyFFT2) * (c * gxFFT2 + d * gyFFT2), (md, nd)
+                )[None, None, :KernelSize, :KernelSize]
             )
             DGaussxy = DGaussxy.at[i : i + 1].set(
-                jnp.fft.ifft2(
-                    (c * gxFFT2 + d * gyFFT2) * (a * gxFFT2 + b * gyFFT2), axes=(-2, -1)
-                ).real[None, None, :KernelSize, :KernelSize]
+                jnp.fft.irfft2(
+                    (c * gxFFT2 + d * gyFFT2) * (a * gxFFT2 + b * gyFFT2), (md, nd)
+                )[None, None, :KernelSize, :KernelSize]
             )
         DGaussxx = DGaussxx - DGaussxx.mean(axis=(-2, -1), keepdims=True)
         DGaussxy = DGaussxy - DGaussxy.mean(axis=(-2, -1), keepdims=True)
@@ -311,172 +347,79 @@ class Loss_jax:
         gp = -(k / sigma) * jnp.exp(-(k**2) / (2 * sigma**2))
         return g.T * gp, gp.T * g
 
+    # the filters are linear, so D * (x - target) = D * x - D * target,
+    # with D * target precomputed by target_terms
     @partial(jit, static_argnums=(0,))
     def TotalVariationLoss(
         self,
         x,
-        target,
-        Dx,
-        Dy,
+        target_d,
+        D,
         mask,
         ind,
     ):
+        A = len(self.angleOffset)
+        d = self.filter(x, D, self.p_tv)
+        dx, dy = d[:, :A], d[:, A:] - target_d
         return (
-            jnp.abs(
-                jnp.take_along_axis(
-                    jax.lax.conv_general_dilated(
-                        jnp.pad(x, self.p_tv, "reflect"),
-                        Dx,
-                        (1, 1),
-                        "VALID",
-                        feature_group_count=x.shape[1],
-                    ),
-                    ind,
-                    axis=1,
-                )
-            )
-            * mask
+            jnp.abs(jnp.take_along_axis(dx, ind, axis=1)) * mask
         ).sum() + mask.sum() / mask.size * jnp.abs(
-            jnp.take_along_axis(
-                jax.lax.conv_general_dilated(
-                    jnp.pad(x - target, self.p_tv, "reflect"), Dy, (1, 1), "VALID"
-                ),
-                ind,
-                axis=1,
-            )
+            jnp.take_along_axis(dy, ind, axis=1)
         ).sum()
 
     @partial(jit, static_argnums=(0,))
     def TotalVariationLoss_plain(
         self,
         x,
-        target,
-        Dx,
-        Dy,
+        target_d,
+        D,
         mask,
         ind,
     ):
-        return (
-            jnp.abs(
-                jax.lax.conv_general_dilated(
-                    jnp.pad(x, self.p_tv, "reflect"),
-                    Dx,
-                    (1, 1),
-                    "VALID",
-                    feature_group_count=x.shape[1],
-                ),
-            )
-            * mask
-        ).sum() + mask.sum() / mask.size * jnp.abs(
-            jax.lax.conv_general_dilated(
-                jnp.pad(x - target, self.p_tv, "reflect"), Dy, (1, 1), "VALID"
-            ),
-        ).sum()
+        d = self.filter(x, D, self.p_tv)
+        dx, dy = d[:, :1], d[:, 1:] - target_d
+        return (jnp.abs(dx) * mask).sum() + mask.sum() / mask.size * jnp.abs(dy).sum()
 
     @partial(jit, static_argnums=0)
     def HessianRegularizationLoss(
         self,
         x,
-        target,
-        DGaussxx,
-        DGaussyy,
-        DGaussxy,
+        target_d,
+        D,
         mask,
         ind,
     ):
+        A = len(self.angleOffset)
+        d = self.filter(x, D, self.p_hessian)
+        dxx, dyy, dxy = d[:, :A], d[:, A : 2 * A], d[:, 2 * A :]
+        dyy, dxy = dyy - target_d[:, :A], dxy - target_d[:, A:]
         return (
-            (
-                jnp.abs(
-                    jnp.take_along_axis(
-                        jax.lax.conv_general_dilated(
-                            jnp.pad(x, self.p_hessian, "reflect"),
-                            DGaussxx,
-                            (1, 1),
-                            "VALID",
-                            feature_group_count=x.shape[1],
-                        ),
-                        ind,
-                        axis=1,
-                    )
-                )
-                * mask
-            ).sum()
+            (jnp.abs(jnp.take_along_axis(dxx, ind, axis=1)) * mask).sum()
             + mask.sum()
             / mask.size
-            * jnp.abs(
-                jnp.take_along_axis(
-                    jax.lax.conv_general_dilated(
-                        jnp.pad(x - target, self.p_hessian, "reflect"),
-                        DGaussyy,
-                        (1, 1),
-                        "VALID",
-                    ),
-                    ind,
-                    axis=1,
-                )
-            ).sum()
+            * jnp.abs(jnp.take_along_axis(dyy, ind, axis=1)).sum()
             + 2
             * mask.sum()
             / mask.size
-            * jnp.abs(
-                jnp.take_along_axis(
-                    jax.lax.conv_general_dilated(
-                        jnp.pad(x - target, self.p_hessian, "reflect"),
-                        DGaussxy,
-                        (1, 1),
-                        "VALID",
-                    ),
-                    ind,
-                    axis=1,
-                )
-            ).sum()
+            * jnp.abs(jnp.take_along_axis(dxy, ind, axis=1)).sum()
         )
 
     @partial(jit, static_argnums=0)
     def HessianRegularizationLoss_plain(
         self,
         x,
-        target,
-        DGaussxx,
-        DGaussyy,
-        DGaussxy,
+        target_d,
+        D,
         mask,
         ind,
     ):
+        d = self.filter(x, D, self.p_hessian)
+        dxx, dyy, dxy = d[:, :1], d[:, 1:2], d[:, 2:]
+        dyy, dxy = dyy - target_d[:, :1], dxy - target_d[:, 1:]
         return (
-            (
-                jnp.abs(
-                    jax.lax.conv_general_dilated(
-                        jnp.pad(x, self.p_hessian, "reflect"),
-                        DGaussxx,
-                        (1, 1),
-                        "VALID",
-                        feature_group_count=x.shape[1],
-                    ),
-                )
-                * mask
-            ).sum()
-            + mask.sum()
-            / mask.size
-            * jnp.abs(
-                jax.lax.conv_general_dilated(
-                    jnp.pad(x - target, self.p_hessian, "reflect"),
-                    DGaussyy,
-                    (1, 1),
-                    "VALID",
-                ),
-            ).sum()
-            + 2
-            * mask.sum()
-            / mask.size
-            * jnp.abs(
-                jax.lax.conv_general_dilated(
-                    jnp.pad(x - target, self.p_hessian, "reflect"),
-                    DGaussxy,
-                    (1, 1),
-                    "VALID",
-                ),
-            ).sum()
+            (jnp.abs(dxx) * mask).sum()
+            + mask.sum() / mask.size * jnp.abs(dyy).sum()
+            + 2 * mask.sum() / mask.size * jnp.abs(dxy).sum()
         )
 
     def __call__(
@@ -503,29 +446,17 @@ class Loss_jax:
             outputGNNraw_full, targets.shape, method="bilinear"
         )
 
-        mse = self.main_loss(targets, outputGNNraw_original)
+        mse = self.main_loss(mask_dict["gf_target"], outputGNNraw_original)
 
         lconst = 6
 
-        wave_decom_dict = [
-            jaxwt.wavedec2(
-                output_att - outputGNNraw_full, "db4", level=1, mode="reflect"
-            )
-        ]
-        for _ in range(lconst - 1):
-            wave_decom_dict.append(
-                jaxwt.wavedec2(
-                    wave_decom_dict[-1][0],
-                    "db4",
-                    level=1,
-                    mode="reflect",
-                )
-            )
-
-        for i in range(lconst):
-            mse = mse + 20 * jnp.sum(jnp.abs(wave_decom_dict[i][1][0]))
-            mse = mse + 20 * jnp.sum(jnp.abs(wave_decom_dict[i][1][1]))
-            mse = mse + 40 * jnp.sum(jnp.abs(wave_decom_dict[i][1][2]))
+        wave_decom = jaxwt.wavedec2(
+            output_att - outputGNNraw_full, "db4", level=lconst, mode="reflect"
+        )
+        for detail in wave_decom[1:]:
+            mse = mse + 20 * jnp.sum(jnp.abs(detail[0]))
+            mse = mse + 20 * jnp.sum(jnp.abs(detail[1]))
+            mse = mse + 40 * jnp.sum(jnp.abs(detail[2]))
 
         outputGNNraw_original, outputGNNraw_original_f = self.non_postive_uint(
             outputGNNraw_original,
@@ -537,38 +468,32 @@ class Loss_jax:
 
         tv = self.total_variation_cal(
             outputGNNraw_original[1:],
-            targets,
-            self.Dx,
-            self.Dy,
+            mask_dict["target_tv"],
+            self.D_tv,
             mask_dict["mask_tv"],
             mask_dict["ind_tv"],
         )
 
         tv = tv + self.total_variation_cal(
             outputGNNraw_original_f[1:],
-            targets_f,
-            self.Dx_f,
-            self.Dy_f,
+            mask_dict["target_tv_f"],
+            self.D_tv_f,
             mask_dict["mask_tv_f"],
             mask_dict["ind_tv_f"],
         )
 
         hessian = self.hessian_cal(
             outputGNNraw_original[1:],
-            targets,
-            self.DGaussxx,
-            self.DGaussyy,
-            self.DGaussxy,
+            mask_dict["target_hessian"],
+            self.D_hessian,
             mask_dict["mask_hessian"],
             mask_dict["ind_hessian"],
         )
 
         hessian = hessian + self.hessian_cal(
             outputGNNraw_original_f[1:],
-            targets_f,
-            self.DGaussxx_f,
-            self.DGaussyy_f,
-            self.DGaussxy_f,
+            mask_dict["target_hessian_f"],
+            self.D_hessian_f,
             mask_dict["mask_hessian_f"],
             mask_dict["ind_hessian_f"],
         )
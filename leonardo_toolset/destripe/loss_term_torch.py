@@ -261,14 +261,52 @@ class Loss_torch(nn.Module):
         self.register_buffer("DGaussyy", DGaussyy.to(torch.float))
         self.register_buffer("DGaussxy", DGaussxy.to(torch.float))
 
-    def gf_loss(self, targets, outputGNNraw_original):
+        # kernels applied to the same input are stacked into one convolution
+        self.register_buffer("D_tv", torch.cat((self.Dx, self.Dy), 0))
+        self.register_buffer("D_tv_f", torch.cat((self.Dx_f, self.Dy_f), 0))
+        self.register_buffer(
+            "D_hessian", torch.cat((self.DGaussxx, self.DGaussyy, self.DGaussxy), 0)
+        )
+        self.register_buffer(
+            "D_hessian_f",
+            torch.cat((self.DGaussxx_f, self.DGaussyy_f, self.DGaussxy_f), 0),
+        )
+        self.wavelet = pywt.Wavelet("db4")
+
+    def gf_loss(self, gf_target, outputGNNraw_original):
         return 10 * torch.sum(
             torch.abs(
-                self.GuidedFilterLoss(targets, targets)
+                gf_target
                 - self.GuidedFilterLoss(outputGNNraw_original, outputGNNraw_original)
             )
         )
 
+    def target_terms(
+        self,
+        targets,
+        targets_f,
+    ):
+        """
+        Terms of the loss that only depend on the targets of a slice. They are
+        computed once per slice and passed in with mask_dict.
+        """
+        A = len(self.angleOffset)
+        with torch.no_grad():
+            return {
+                "gf_target": self.GuidedFilterLoss(targets, targets),
+                "target_tv": self.filter(targets, self.D_tv[A:], self.p_tv),
+                "target_tv_f": self.filter(targets_f, self.D_tv_f[A:], self.p_tv),
+                "target_hessian": self.filter(
+                    targets, self.D_hessian[A:], self.p_hessian
+                ),
+                "target_hessian_f": self.filter(
+                    targets_f, self.D_hessian_f[A:], self.p_hessian
+                ),
+            }
+
+    def filter(self, x, D, p):
+        return torch.conv2d(F.pad(x, p, "reflect"), D, stride=1, padding=0)
+
     def total_variation_kernel(
         self,
         angle_list,
@@ -302,7 +340,7 @@ class Loss_torch(nn.Module):
 
         md = shape_params["md"] if shape_params["is_vertical"] else shape_params["nd"]
         nd = shape_params["nd"] if shape_params["is_vertical"] else shape_params["md"]
-        gxFFT2, gyFFT2 = np.fft.fft2(gx, (md, nd)), np.fft.fft2(gy, (md, nd))
+        gxFFT2, gyFFT2 = np.fft.rfft2(gx, (md, nd)), np.fft.rfft2(gy, (md, nd))
         DGaussxx = np.zeros((len(angleOffset), 1, KernelSize, KernelSize))
         DGaussxy = np.zeros((len(angleOffset), 1, KernelSize, KernelSize))
         DGaussyy = np.zeros((len(angleOffset), 1, KernelSize, KernelSize))
@@ -313,15 +351,15 @@ class Loss_torch(nn.Module):
                 math.cos(-A / 180 * math.pi + math.pi / 2),
                 math.sin(-A / 180 * math.pi + math.pi / 2),
             )
-            DGaussxx[i : i + 1] = np.fft.ifft2(
-                (a * gxFFT2 + b * gyFFT2) * (a * gxFFT2 + b * gyFFT2), axes=(-2, -1)
-            ).real[None, None, :KernelSize, :KernelSize]
-            DGaussyy[i : i + 1] = np.fft.ifft2(
-                (c * gxFFT2 + d * gyFFT2) * (c * gxFFT2 + d * gyFFT2), axes=(-2, -1)
-            ).real[None, None, :KernelSize, :KernelSize]
-            DGaussxy[i : i + 1] = np.fft.ifft2(
-                (c * gxFFT2 + d * gyFFT2) * (a * gxFFT2 + b * gyFFT2), axes=(-2, -1)
-            ).real[None, None, :KernelSize, :KernelSize]
+            DGaussxx[i : i + 1] = np.fft.irfft2(
+                (a * gxFFT2 + b * gyFFT2) * (a * gxFFT2 + b * gyFFT2), (md, nd)
+            )[None, None, :KernelSize, :KernelSize]
+            DGaussyy[i : i + 1] = np.fft.irfft2(
+                (c * gxFFT2 + d * gyFFT2) * (c * gxFFT2 + d * gyFFT2), (md, nd)
+            )[None, None, :KernelSize, :KernelSize]
+            DGaussxy[i : i + 1] = np.fft.irfft2(
+                (c * gxFFT2 + d * gyFFT2) * (a * gxFFT2 + b * gyFFT2), (md, nd)
+            )[None, None, :KernelSize, :KernelSize]
         DGaussxx = DGaussxx - DGaussxx.mean(axis=(-2, -1), keepdims=True)
         DGaussxy = DGaussxy - DGaussxy.mean(axis=(-2, -1), keepdims=True)
         DGaussyy = DGaussyy - DGaussyy.mean(axis=(-2, -1), keepdims=True)
@@ -341,170 +379,72 @@ class Loss_torch(nn.Module):
         gp = -(k / sigma) * np.exp(-(k**2) / (2 * sigma**2))
         return g.T * gp, gp.T * g
 
+    # the filters are linear, so D * (x - target) = D * x - D * target,
+    # with D * target precomputed by target_terms
     def TotalVariationLoss(
         self,
         x,
-        target,
-        Dx,
-        Dy,
+        target_d,
+        D,
         mask,
         ind,
     ):
+        dx, dy = torch.split(self.filter(x, D, self.p_tv), len(self.angleOffset), 1)
         return (
-            torch.abs(
-                torch.take_along_dim(
-                    torch.conv2d(
-                        F.pad(x, self.p_tv, "reflect"),
-                        Dx,
-                        stride=1,
-                        padding=0,
-                    ),
-                    ind,
-                    1,
-                )
-            )
-            * mask
+            torch.abs(torch.take_along_dim(dx, ind, 1)) * mask
         ).sum() + mask.sum() / mask.numel() * torch.abs(
-            torch.take_along_dim(
-                torch.conv2d(
-                    F.pad(x - target, self.p_tv, "reflect"),
-                    Dy,
-                    stride=1,
-                    padding=0,
-                ),
-                ind,
-                1,
-            )
+            torch.take_along_dim(dy - target_d, ind, 1)
         ).sum()
 
     def TotalVariationLoss_plain(
         self,
         x,
-        target,
-        Dx,
-        Dy,
+        target_d,
+        D,
         mask,
         ind,
     ):
-        return (
-            torch.abs(
-                torch.conv2d(
-                    F.pad(x, self.p_tv, "reflect"),
-                    Dx,
-                    stride=1,
-                    padding=0,
-                ),
-            )
-            * mask
-        ).sum() + mask.sum() / mask.numel() * torch.abs(
-            torch.conv2d(
-                F.pad(x - target, self.p_tv, "reflect"),
-                Dy,
-                stride=1,
-                padding=0,
-            ),
+        dx, dy = torch.split(self.filter(x, D, self.p_tv), 1, 1)
+        return (torch.abs(dx) * mask).sum() + mask.sum() / mask.numel() * torch.abs(
+            dy - target_d
         ).sum()
 
     def HessianRegularizationLoss(
         self,
         x,
-        target,
-        DGaussxx,
-        DGaussyy,
-        DGaussxy,
+        target_d,
+        D,
         mask,
         ind,
     ):
+        A = len(self.angleOffset)
+        dxx, dyy, dxy = torch.split(self.filter(x, D, self.p_hessian), A, 1)
+        tyy, txy = torch.split(target_d, A, 1)
         return (
-            (
-                torch.abs(
-                    torch.take_along_dim(
-                        torch.conv2d(
-                            F.pad(x, self.p_hessian, "reflect"),
-                            DGaussxx,
-                            stride=1,
-                            padding=0,
-                        ),
-                        ind,
-                        1,
-                    )
-                )
-                * mask
-            ).sum()
+            (torch.abs(torch.take_along_dim(dxx, ind, 1)) * mask).sum()
             + mask.sum()
             / mask.numel()
-            * torch.abs(
-                torch.take_along_dim(
-                    torch.conv2d(
-                        F.pad(x - target, self.p_hessian, "reflect"),
-                        DGaussyy,
-                        stride=1,
-                        padding=0,
-                    ),
-                    ind,
-                    1,
-                )
-            ).sum()
+            * torch.abs(torch.take_along_dim(dyy - tyy, ind, 1)).sum()
             + 2
             * mask.sum()
             / mask.numel()
-            * torch.abs(
-                torch.take_along_dim(
-                    torch.conv2d(
-                        F.pad(x - target, self.p_hessian, "reflect"),
-                        DGaussxy,
-                        stride=1,
-                        padding=0,
-                    ),
-                    ind,
-                    1,
-                )
-            ).sum()
+            * torch.abs(torch.take_along_dim(dxy - txy, ind, 1)).sum()
         )
 
     def HessianRegularizationLoss_plain(
         self,
         x,
-        target,
-        DGaussxx,
-        DGaussyy,
-        DGaussxy,
+        target_d,
+        D,
         mask,
         ind,
     ):
+        dxx, dyy, dxy = torch.split(self.filter(x, D, self.p_hessian), 1, 1)
+        tyy, txy = torch.split(target_d, 1, 1)
         return (
-            (
-                torch.abs(
-                    torch.conv2d(
-                        F.pad(x, self.p_hessian, "reflect"),
-                        DGaussxx,
-                        stride=1,
-                        padding=0,
-                    ),
-                )
-                * mask
-            ).sum()
-            + mask.sum()
-            / mask.numel()
-            * torch.abs(
-                torch.conv2d(
-                    F.pad(x - target, self.p_hessian, "reflect"),
-                    DGaussyy,
-                    stride=1,
-                    padding=0,
-                ),
-            ).sum()
-            + 2
-            * mask.sum()
-            / mask.numel()
-            * torch.abs(
-                torch.conv2d(
-                    F.pad(x - target, self.p_hessian, "reflect"),
-                    DGaussxy,
-                    stride=1,
-                    padding=0,
-                ),
-            ).sum()
+            (torch.abs(dxx) * mask).sum()
+            + mask.sum() / mask.numel() * torch.abs(dyy - tyy).sum()
+            + 2 * mask.sum() / mask.numel() * torch.abs(dxy - txy).sum()
         )
 
     def forward(
@@ -534,41 +474,19 @@ class Loss_torch(nn.Module):
             align_corners=True,
         )
 
-        mse = self.main_loss(targets, outputGNNraw_original)
+        mse = self.main_loss(mask_dict["gf_target"], outputGNNraw_original)
 
-        kernel = pywt.Wavelet("db4")
         lconst = 6
 
-        output_att_dict = [ptwt.wavedec2(output_att, kernel, level=1, mode="reflect")]
-
-        for _ in range(lconst - 1):
-            output_att_dict.append(
-                ptwt.wavedec2(output_att_dict[-1][0], kernel, level=1, mode="reflect")
-            )
-
-        output_gnn_hr_dict = [
-            ptwt.wavedec2(outputGNNraw_full, kernel, level=1, mode="reflect")
-        ]
-        for _ in range(lconst - 1):
-            output_gnn_hr_dict.append(
-                ptwt.wavedec2(
-                    output_gnn_hr_dict[-1][0],
-                    kernel,
-                    level=1,
-                    mode="reflect",
-                )
-            )
-
-        for i in range(lconst):
-            mse = mse + 20 * torch.sum(
-                torch.abs(output_att_dict[i][1][0] - output_gnn_hr_dict[i][1][0])
-            )
-            mse = mse + 20 * torch.sum(
-                torch.abs(output_att_dict[i][1][1] - output_gnn_hr_dict[i][1][1])
-            )
-            mse = mse + 40 * torch.sum(
-                torch.abs(output_att_dict[i][1][2] - output_gnn_hr_dict[i][1][2])
-            )
+        # the decomposition is linear, so the detail bands of the difference
+        # are the differences of the detail bands
+        wave_decom = ptwt.wavedec2(
+            output_att - outputGNNraw_full, self.wavelet, level=lconst, mode="reflect"
+        )
+        for detail in wave_decom[1:]:
+            mse = mse + 20 * torch.sum(torch.abs(detail[0]))
+            mse = mse + 20 * torch.sum(torch.abs(detail[1]))
+            mse = mse + 40 * torch.sum(torch.abs(detail[2]))
 
         outputGNNraw_original, outputGNNraw_original_f = self.non_postive_uint(
             outputGNNraw_original,
@@ -580,38 +498,32 @@ class Loss_torch(nn.Module):
 
         tv = self.total_variation_cal(
             outputGNNraw_original[1:],
-            targets,
-            self.Dx,
-            self.Dy,
+            mask_dict["target_tv"],
+            self.D_tv,
             mask_dict["mask_tv"],
             mask_dict["ind_tv"],
         )
 
         tv = tv + self.total_variation_cal(
             outputGNNraw_original_f[1:],
-            targets_f,
-            self.Dx_f,
-            self.Dy_f,
+            mask_dict["target_tv_f"],
+            self.D_tv_f,
             mask_dict["mask_tv_f"],
             mask_dict["ind_tv_f"],
         )
 
         hessian = self.hessian_cal(
             outputGNNraw_original[1:],
-            targets,
-            self.DGaussxx,
-            self.DGaussyy,
-            self.DGaussxy,
+            mask_dict["target_hessian"],
+            self.D_hessian,
             mask_dict["mask_hessian"],
             mask_dict["ind_hessian"],
         )
 
         hessian = hessian + self.hessian_cal(
             outputGNNraw_original_f[1:],
-            targets_f,
-            self.DGaussxx_f,
-            self.DGaussyy_f,
-            self.DGaussxy_f,
+            mask_dict["target_hessian_f"],
+            self.D_hessian_f,
             mask_dict["mask_hessian_f"],
             mask_dict["ind_hessian_f"],
         )
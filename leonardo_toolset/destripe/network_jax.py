@@ -6,6 +6,7 @@ import jax.numpy as jnp
 import numpy as np
 
 from leonardo_toolset.destripe.utils_jax import generate_mapping_coordinates
+from leonardo_toolset.destripe.utils import cached_arrays, half_spectrum_index
 
 
 class Cmplx_Xavier_Init(hk.initializers.Initializer):
@@ -112,6 +113,39 @@ class ResLearning(hk.Module):
         return complex_relu(inx + CLinear(self.outc)(x))
 
 
+@jax.custom_vjp
+def neighbor_aggregate(x, w, NI):
+    """
+    out[n] = sum_k w[k, n] * x[NI[k, n]]
+
+    Accumulates one neighbour at a time, so that neither the forward nor the
+    backward pass holds the (k, n, ...) gather of x; only x and w are saved.
+    """
+    shape = (-1,) + (1,) * (x.ndim - 1)
+    out = x[NI[0]] * w[0].reshape(shape)
+    for k in range(1, NI.shape[0]):
+        out = out + x[NI[k]] * w[k].reshape(shape)
+    return out
+
+
+def neighbor_aggregate_fwd(x, w, NI):
+    return neighbor_aggregate(x, w, NI), (x, w, NI)
+
+
+def neighbor_aggregate_bwd(res, g):
+    x, w, NI = res
+    shape = (-1,) + (1,) * (x.ndim - 1)
+    grad_x = jnp.zeros_like(x)
+    grad_w = []
+    for k in range(NI.shape[0]):
+        grad_x = grad_x.at[NI[k]].add(g * w[k].reshape(shape))
+        grad_w.append((g * x[NI[k]]).reshape(g.shape[0], -1).sum(1))
+    return grad_x, jnp.stack(grad_w, 0), None
+
+
+neighbor_aggregate.defvjp(neighbor_aggregate_fwd, neighbor_aggregate_bwd)
+
+
 class gnn(hk.Module):
     def __init__(
         self,
@@ -136,7 +170,7 @@ class gnn(hk.Module):
             jnp.complex64,
             init=Cmplx_Xavier_Init(self.NI.shape[0], self.NI.shape[1]),
         )
-        Xfcx = jnp.sum(jnp.einsum("knbc,kn->knbc", Xf[self.NI, :], w), 0)  # (M*N, c)
+        Xfcx = neighbor_aggregate(Xf, w, self.NI)  # (M*N, c)
         Xf_tvx = jnp.concatenate((Xfcx, Xf[self.hier_mask, :]), 0)[
             self.hier_ind, :
         ].reshape(
@@ -220,37 +254,30 @@ class GuidedFilterJAX(hk.Module):
             self.boxfilter(XN, self.kernelL[i], self.pc[i], self.pr[i])
             for i in range(self.AngleNum)
         ]
+        to_half, to_half_conj, from_half, from_half_conj = half_spectrum_index(m, n)
         self.kernel_fft = []
         for k in self.kernelL:
+            k_fft = jnp.fft.rfft2(k / k.sum(), (m, n)).reshape(-1)[to_half]
             self.kernel_fft.append(
-                jnp.fft.fftshift(
-                    jnp.fft.fft2(
-                        k / k.sum(),
-                        (m, n),
-                    )
-                ).reshape(-1)[
-                    : (m * n) // 2
-                ][..., None]
+                jnp.where(to_half_conj, jnp.conj(k_fft), k_fft)[..., None]
             )
         self.m_l = m
         self.n_l = n
+        self.from_half, self.from_half_conj = from_half, from_half_conj[:, None]
 
     def fourierResult(
         self,
         z,
         aver,
     ):
+        # lay the half spectrum out as input of irfft2, which implies the
+        # conjugate half
+        z = jnp.concatenate((z, aver), -2)[..., self.from_half, :]
+        z = jnp.where(self.from_half_conj, jnp.conj(z), z)
         return jnp.abs(
-            jnp.fft.ifft2(
-                jnp.fft.ifftshift(
-                    jnp.concatenate(
-                        (z, aver, jnp.conj(jnp.flip(z, -2))),
-                        -2,
-                    )
-                    .reshape(1, self.m_l, -1, 1)
-                    .transpose(0, 3, 1, 2),
-                    axes=(-2, -1),
-                )
+            jnp.fft.irfft2(
+                z.reshape(1, self.m_l, -1, 1).transpose(0, 3, 1, 2),
+                s=(self.m_l, self.n_l),
             )
         )
 
@@ -310,52 +337,28 @@ class DeStripeModel_jax(hk.Module):
         n_l,
         r,
         inc=16,
+        cache_dir=None,
     ):
         super().__init__()
         self.NI, self.hier_mask, self.hier_ind, self.inc = NI, hier_mask, hier_ind, inc
 
         self.m_l, self.n_l = m_l, n_l
         self.Angle = Angle
-
-        gx_0 = jnp.fft.fftshift(
-            jnp.fft.fft2(jnp.array([[1, -1]], dtype=jnp.float32), (self.m_l, self.n_l))
+        _, _, self.from_half, self.from_half_conj = half_spectrum_index(
+            self.m_l, self.n_l
         )
-        gy_0 = jnp.fft.fftshift(
-            jnp.fft.fft2(
-                jnp.array([[1], [-1]], dtype=jnp.float32), (self.m_l, self.n_l)
+        self.from_half_conj = self.from_half_conj[:, None]
+
+        self.TVfftx, self.inverseTVfftx, self.TVffty, self.inverseTVffty = (
+            jnp.asarray(x)
+            for x in cached_arrays(
+                "tv",
+                (self.m_l, self.n_l, float(r), tuple(float(A) for A in Angle), "jax"),
+                lambda: self.tv_spectra(Angle, r),
+                cache_dir=cache_dir,
             )
         )
 
-        self.TVfftx = []
-        self.inverseTVfftx = []
-        self.TVffty = []
-        self.inverseTVffty = []
-        for i, A in enumerate(Angle):
-            trans_matrix = generate_mapping_coordinates(
-                np.rad2deg(np.arctan(r * np.tan(np.deg2rad(-A)))),
-                gx_0.shape[0],
-                gx_0.shape[1],
-                reshape=False,
-            )
-            self.fftnt(
-                jax.scipy.ndimage.map_coordinates(
-                    gx_0[None, None], trans_matrix, 1, mode="nearest"
-                )[0, 0],
-                self.m_l,
-                self.n_l,
-            )
-            self.fftn(
-                jax.scipy.ndimage.map_coordinates(
-                    gy_0[None, None], trans_matrix, 1, mode="nearest"
-                )[0, 0],
-                self.m_l,
-                self.n_l,
-            )
-        self.TVfftx = jnp.concatenate(self.TVfftx, 0)
-        self.inverseTVfftx = jnp.concatenate(self.inverseTVfftx, 0)
-        self.TVffty = jnp.concatenate(self.TVffty, 0)
-        self.inverseTVffty = jnp.concatenate(self.inverseTVffty, 0)
-
         self.eigDtD = jnp.power(jnp.abs(self.TVfftx), 2) + jnp.power(
             jnp.abs(self.TVffty), 2
         )
@@ -420,6 +423,57 @@ class DeStripeModel_jax(hk.Module):
             ]
         )
 
+    def tv_spectra(
+        self,
+        Angle,
+        r,
+    ):
+        # evaluated eagerly, so that the spectra can be cached even when the
+        # model is constructed while tracing
+        with jax.ensure_compile_time_eval():
+            gx_0 = jnp.fft.fftshift(
+                jnp.fft.fft2(
+                    jnp.array([[1, -1]], dtype=jnp.float32), (self.m_l, self.n_l)
+                )
+            )
+            gy_0 = jnp.fft.fftshift(
+                jnp.fft.fft2(
+                    jnp.array([[1], [-1]], dtype=jnp.float32), (self.m_l, self.n_l)
+                )
+            )
+
+            self.TVfftx = []
+            self.inverseTVfftx = []
+            self.TVffty = []
+            self.inverseTVffty = []
+            for i, A in enumerate(Angle):
+                trans_matrix = generate_mapping_coordinates(
+                    np.rad2deg(np.arctan(r * np.tan(np.deg2rad(-A)))),
+                    gx_0.shape[0],
+                    gx_0.shape[1],
+                    reshape=False,
+                )
+                self.fftnt(
+                    jax.scipy.ndimage.map_coordinates(
+                        gx_0[None, None], trans_matrix, 1, mode="nearest"
+                    )[0, 0],
+                    self.m_l,
+                    self.n_l,
+                )
+                self.fftn(
+                    jax.scipy.ndimage.map_coordinates(
+                        gy_0[None, None], trans_matrix, 1, mode="nearest"
+                    )[0, 0],
+                    self.m_l,
+                    self.n_l,
+                )
+            return (
+                jnp.concatenate(self.TVfftx, 0),
+                jnp.concatenate(self.inverseTVfftx, 0),
+                jnp.concatenate(self.TVffty, 0),
+                jnp.concatenate(self.inverseTVffty, 0),
+            )
+
     def fftnt(
         self,
         x,
@@ -445,17 +499,14 @@ class DeStripeModel_jax(hk.Module):
         z,
         aver,
     ):
+        # lay the half spectrum out as input of irfft2, which implies the
+        # conjugate half
+        z = jnp.concatenate((z, aver), -2)[..., self.from_half, :]
+        z = jnp.where(self.from_half_conj, jnp.conj(z), z)
         return jnp.abs(
-            jnp.fft.ifft2(
-                jnp.fft.ifftshift(
-                    jnp.concatenate(
-                        (z, aver, jnp.conj(jnp.flip(z, -2))),
-                        -2,
-                    )
-                    .reshape(1, self.m_l, -1, 1)
-                    .transpose(0, 3, 1, 2),
-                    axes=(-2, -1),
-                )
+            jnp.fft.irfft2(
+                z.reshape(1, self.m_l, -1, 1).transpose(0, 3, 1, 2),
+                s=(self.m_l, self.n_l),
             )
         )
 
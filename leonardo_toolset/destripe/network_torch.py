@@ -1,11 +1,11 @@
-import copy
-
 import numpy as np
 import scipy
 import torch
 import torch.nn as nn
 from torch.nn import functional as F
 
+from leonardo_toolset.destripe.utils import cached_arrays, half_spectrum_index
+
 
 class GuidedFilter(nn.Module):
     def __init__(self, rx, ry, r, Angle, m=None, n=None, eps=1e-9):
@@ -34,7 +34,7 @@ class GuidedFilter(nn.Module):
 
     def __call__(self, X, y, hX, coor):
         if self.N is None:
-            XN = torch.ones_like(X)
+            XN = torch.ones((1, 1) + tuple(X.shape[-2:]), device=X.device)
             self.N = [
                 self.boxfilter(
                     XN,
@@ -45,7 +45,7 @@ class GuidedFilter(nn.Module):
                 for i in range(self.AngleNum)
             ]
 
-        X0 = copy.deepcopy(X)
+        X0 = X
         for i in range(self.AngleNum):
             b = (
                 self.boxfilter(
@@ -111,6 +111,41 @@ def CmplxRndUniform(
     return torch.from_numpy(real_part + 1j * imag_part).to(torch.cfloat)
 
 
+class NeighborAggregate(torch.autograd.Function):
+    """
+    out[n] = sum_k w[k, n] * x[NI[k, n]]
+
+    Accumulates one neighbour at a time, so that neither the forward nor the
+    backward pass holds the (k, n, ...) gather of x; only x and w are saved.
+    """
+
+    generate_vmap_rule = True
+
+    @staticmethod
+    def forward(x, w, NI):
+        shape = (-1,) + (1,) * (x.dim() - 1)
+        out = x[NI[0]] * w[0].reshape(shape)
+        for k in range(1, NI.shape[0]):
+            out = out + x[NI[k]] * w[k].reshape(shape)
+        return out
+
+    @staticmethod
+    def setup_context(ctx, inputs, output):
+        x, w, NI = inputs
+        ctx.save_for_backward(x, w, NI)
+
+    @staticmethod
+    def backward(ctx, grad):
+        x, w, NI = ctx.saved_tensors
+        shape = (-1,) + (1,) * (x.dim() - 1)
+        grad_x = torch.zeros_like(x)
+        grad_w = []
+        for k in range(NI.shape[0]):
+            grad_x = grad_x.index_add(0, NI[k], grad * w[k].conj().reshape(shape))
+            grad_w.append((grad * x[NI[k]].conj()).flatten(1).sum(1))
+        return grad_x, torch.stack(grad_w, 0), None
+
+
 class gnn(nn.Module):
     def __init__(
         self,
@@ -133,9 +168,7 @@ class gnn(nn.Module):
         self,
         Xf,
     ):
-        Xfcx = torch.sum(
-            torch.einsum("knbc,kn->knbc", Xf[self.NI, :], self.w), 0
-        )  # (M*N, c)
+        Xfcx = NeighborAggregate.apply(Xf, self.w, self.NI)  # (M*N, c)
         Xf_tvx = torch.cat((Xfcx, Xf[self.hier_mask, :]), 0)[self.hier_ind, :].reshape(
             1, -1, 1, self.inc
         )
@@ -232,58 +265,20 @@ class DeStripeModel_torch(nn.Module):
         n_l,
         r,
         inc=16,
+        cache_dir=None,
     ):
         super(DeStripeModel_torch, self).__init__()
         self.inc = inc
         self.m_l, self.n_l = m_l, n_l
         self.Angle = Angle
 
-        gx_0 = np.fft.fftshift(
-            np.fft.fft2(np.array([[1, -1]], dtype=np.float32), (self.m_l, self.n_l))
-        )
-        gy_0 = np.fft.fftshift(
-            np.fft.fft2(np.array([[1], [-1]], dtype=np.float32), (self.m_l, self.n_l))
+        TVfftx, inverseTVfftx, TVffty, inverseTVffty = cached_arrays(
+            "tv",
+            (self.m_l, self.n_l, float(r), tuple(float(A) for A in Angle), "torch"),
+            lambda: self.tv_spectra(Angle, r),
+            cache_dir=cache_dir,
         )
 
-        TVfftx = []
-        inverseTVfftx = []
-        TVffty = []
-        inverseTVffty = []
-        for i, A in enumerate(Angle):
-            TVfftx, inverseTVfftx = self.fftnt(
-                scipy.ndimage.rotate(
-                    gx_0,
-                    np.rad2deg(np.arctan(r * np.tan(np.deg2rad(A)))),
-                    axes=(-2, -1),
-                    reshape=False,
-                    order=1,
-                    mode="nearest",
-                ),
-                self.m_l,
-                self.n_l,
-                TVfftx,
-                inverseTVfftx,
-            )
-            TVffty, inverseTVffty = self.fftn(
-                scipy.ndimage.rotate(
-                    gy_0,
-                    np.rad2deg(np.arctan(r * np.tan(np.deg2rad(A)))),
-                    axes=(-2, -1),
-                    reshape=False,
-                    order=1,
-                    mode="nearest",
-                ),
-                self.m_l,
-                self.n_l,
-                TVffty,
-                inverseTVffty,
-            )
-
-        TVfftx = np.concatenate(TVfftx, 0)
-        inverseTVfftx = np.concatenate(inverseTVfftx, 0)
-        TVffty = np.concatenate(TVffty, 0)
-        inverseTVffty = np.concatenate(inverseTVffty, 0)
-
         eigDtD = np.power(np.abs(TVfftx), 2) + np.power(
             np.abs(TVffty),
             2,
@@ -304,6 +299,15 @@ class DeStripeModel_torch(nn.Module):
         self.register_buffer(
             "eigDtD", torch.from_numpy(eigDtD)[..., None].to(torch.cfloat)
         )
+        _, _, from_half, from_half_conj = half_spectrum_index(self.m_l, self.n_l)
+        self.register_buffer(
+            "from_half", torch.from_numpy(from_half), persistent=False
+        )
+        self.register_buffer(
+            "from_half_conj",
+            torch.from_numpy(from_half_conj)[:, None],
+            persistent=False,
+        )
 
         self.p = ResLearning(inc)
 
@@ -367,6 +371,59 @@ class DeStripeModel_torch(nn.Module):
                             n.weight.data = Cmplx_Xavier_Init(n.weight.data)
                             n.bias.data = CmplxRndUniform(n.bias.data)
 
+    def tv_spectra(
+        self,
+        Angle,
+        r,
+    ):
+        gx_0 = np.fft.fftshift(
+            np.fft.fft2(np.array([[1, -1]], dtype=np.float32), (self.m_l, self.n_l))
+        )
+        gy_0 = np.fft.fftshift(
+            np.fft.fft2(np.array([[1], [-1]], dtype=np.float32), (self.m_l, self.n_l))
+        )
+
+        TVfftx = []
+        inverseTVfftx = []
+        TVffty = []
+        inverseTVffty = []
+        for i, A in enumerate(Angle):
+            TVfftx, inverseTVfftx = self.fftnt(
+                scipy.ndimage.rotate(
+                    gx_0,
+                    np.rad2deg(np.arctan(r * np.tan(np.deg2rad(A)))),
+                    axes=(-2, -1),
+                    reshape=False,
+                    order=1,
+                    mode="nearest",
+                ),
+                self.m_l,
+                self.n_l,
+                TVfftx,
+                inverseTVfftx,
+            )
+            TVffty, inverseTVffty = self.fftn(
+                scipy.ndimage.rotate(
+                    gy_0,
+                    np.rad2deg(np.arctan(r * np.tan(np.deg2rad(A)))),
+                    axes=(-2, -1),
+                    reshape=False,
+                    order=1,
+                    mode="nearest",
+                ),
+                self.m_l,
+                self.n_l,
+                TVffty,
+                inverseTVffty,
+            )
+
+        return (
+            np.concatenate(TVfftx, 0),
+            np.concatenate(inverseTVfftx, 0),
+            np.concatenate(TVffty, 0),
+            np.concatenate(inverseTVffty, 0),
+        )
+
     def fftnt(
         self,
         x,
@@ -398,17 +455,14 @@ class DeStripeModel_torch(nn.Module):
         z,
         aver,
     ):
+        # lay the half spectrum out as input of irfft2, which implies the
+        # conjugate half
+        z = torch.cat((z, aver), -2)[..., self.from_half, :]
+        z = torch.where(self.from_half_conj, torch.conj(z), z)
         return torch.abs(
-            torch.fft.ifft2(
-                torch.fft.ifftshift(
-                    torch.cat(
-                        (z, aver, torch.conj(torch.flip(z, [-2]))),
-                        -2,
-                    )
-                    .reshape(1, self.m_l, -1, 1)
-                    .permute(0, 3, 1, 2),
-                    dim=(-2, -1),
-                )
+            torch.fft.irfft2(
+                z.reshape(1, self.m_l, -1, 1).permute(0, 3, 1, 2),
+                s=(self.m_l, self.n_l),
             )
         )
 
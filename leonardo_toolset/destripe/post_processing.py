@@ -5,52 +5,137 @@ import torch.nn as nn
 import numpy as np
 from torch.optim import Adam
 import torch
-from leonardo_toolset.destripe.utils import crop_center
-import copy
-from skimage.filters import threshold_otsu
+from leonardo_toolset.destripe.utils import (
+    crop_center,
+    ConvergenceMonitor,
+    otsu_thresholds,
+)
 import tqdm
 import torch.nn.functional as F
 import matplotlib.pyplot as plt
 from leonardo_toolset.destripe.guided_filter_upsample import wave_rec
-import cv2
-import torchvision
+import time
+
+
+class RotationPlan:
+    """
+    Bilinear rotation of (H, W) images by a fixed angle.
+
+    Follows torchvision.transforms.functional.rotate (rotation about the
+    image center, zero fill, optional expand), but builds the sampling grid
+    once so that it can be reused for every slice of a volume, and for a
+    stack of tensors in a single grid_sample call.
+    """
+
+    def __init__(self, H, W, angle, expand, device):
+        rot = np.deg2rad(-angle)
+        theta = np.array(
+            [[np.cos(rot), np.sin(rot), 0.0], [-np.sin(rot), np.cos(rot), 0.0]]
+        )
+        if expand:
+            corners = np.array(
+                [
+                    [-0.5 * W, -0.5 * H, 1.0],
+                    [-0.5 * W, 0.5 * H, 1.0],
+                    [0.5 * W, 0.5 * H, 1.0],
+                    [0.5 * W, -0.5 * H, 1.0],
+                ],
+                dtype=np.float32,
+            )
+            pts = corners @ theta.T.astype(np.float32)
+            # truncate precision to 1e-4 to avoid ceil of Xe-15 to 1.0
+            cmax = np.ceil(np.trunc((pts.max(0) + [0.5 * W, 0.5 * H]) / 1e-4) * 1e-4)
+            cmin = np.floor(np.trunc((pts.min(0) + [0.5 * W, 0.5 * H]) / 1e-4) * 1e-4)
+            ow, oh = (int(s) for s in cmax - cmin)
+        else:
+            ow, oh = W, H
+        x = torch.linspace(-ow * 0.5 + 0.5, ow * 0.5 - 0.5, steps=ow, device=device)
+        y = torch.linspace(-oh * 0.5 + 0.5, oh * 0.5 - 0.5, steps=oh, device=device)
+        base_grid = torch.stack(
+            (
+                x[None, :].expand(oh, ow),
+                y[:, None].expand(oh, ow),
+                torch.ones(oh, ow, device=device),
+            ),
+            -1,
+        )
+        theta = torch.from_numpy(theta.T).to(torch.float32).to(device)
+        theta = theta / torch.tensor([0.5 * W, 0.5 * H], device=device)
+        self.grid = (base_grid.reshape(-1, 3) @ theta).reshape(1, oh, ow, 2)
+        self.in_shape = (H, W)
+        self.out_shape = (oh, ow)
+
+    def __call__(self, *xs):
+        """
+        Rotate each of xs, shaped (..., H, W), with one grid_sample call.
+        Integer and boolean inputs are cast back to their dtype the way
+        torchvision does.
+        """
+        dtype = (
+            torch.float64
+            if any(x.dtype == torch.float64 for x in xs)
+            else torch.float32
+        )
+        flat = torch.cat([x.reshape(-1, 1, *self.in_shape).to(dtype) for x in xs], 0)
+        flat = F.grid_sample(
+            flat,
+            self.grid.to(dtype).expand(flat.shape[0], -1, -1, -1),
+            mode="bilinear",
+            padding_mode="zeros",
+            align_corners=False,
+        )
+        out = []
+        for x, y in zip(
+            xs, torch.split(flat, [x.numel() // np.prod(self.in_shape) for x in xs])
+        ):
+            y = y.reshape(*x.shape[:-2], *self.out_shape)
+            if not (torch.is_floating_point(x) or x.dtype == torch.bool):
+                y = torch.round(y)
+            out.append(y.to(x.dtype))
+        return out
+
+
+_rotation_plans = {}
+
+
+def rotation_plan(H, W, angle, expand, device):
+    key = (H, W, float(angle), expand, str(device))
+    if key not in _rotation_plans:
+        _rotation_plans[key] = RotationPlan(H, W, angle, expand, device)
+    return _rotation_plans[key]
+
+
+def rotate_many(xs, angle, expand=True):
+    """
+    Rotate tensors sharing the same (H, W) and device by angle degrees,
+    reusing the cached RotationPlan of that geometry.
+    """
+    return rotation_plan(*xs[0].shape[-2:], angle, expand, xs[0].device)(*xs)
 
 
 def rotate(x, angle, expand=True):
-    x = torchvision.transforms.functional.rotate(
-        x,
-        angle=angle,
-        interpolation=torchvision.transforms.InterpolationMode.BILINEAR,
-        expand=expand,
-    )
-    return x
+    return rotate_many([x], angle, expand=expand)[0]
 
 
-def last_nonzero(
-    arr,
-    mask,
-    axis,
-    invalid_val=np.nan,
-):
-    if mask is None:
-        mask = arr != 0
-    if type(mask) is not np.ndarray:
-        mask = mask.cpu().detach().numpy()
-    val = mask.shape[axis] - np.flip(mask, axis=axis).argmax(axis=axis) - 1
-    return np.where(mask.any(axis=axis), val, invalid_val)
+def as_tensor(x, device):
+    if isinstance(x, np.ndarray):
+        x = torch.from_numpy(np.ascontiguousarray(x))
+    return x.detach().to(device)
 
 
-def first_nonzero(
-    arr,
-    mask,
+def nonzero_range(
+    x,
     axis,
-    invalid_val=np.nan,
 ):
-    if mask is None:
-        mask = arr != 0
-    if type(mask) is not np.ndarray:
-        mask = mask.cpu().detach().numpy()
-    return np.where(mask.any(axis=axis), mask.argmax(axis=axis), invalid_val)
+    """
+    First and last index along axis at which x has a nonzero entry,
+    or None if x is all zero.
+    """
+    hit = (x != 0).movedim(axis, -1).reshape(-1, x.shape[axis]).any(0)
+    idx = torch.nonzero(hit)
+    if len(idx) == 0:
+        return None
+    return idx[0, 0].item(), idx[-1, 0].item()
 
 
 def edge_padding_xy(x, rx, ry):
@@ -102,16 +187,40 @@ def mask_with_lower_intensity(
     return seg_mask
 
 
+def spread_along_rows(seed, free):
+    # free pixels of a row between two non-free ones share a run id,
+    # and a run is reached as soon as one of its pixels is a seed
+    H, W = free.shape
+    run = torch.cumsum(~free, -1) + torch.arange(H, device=free.device)[:, None] * (
+        W + 1
+    )
+    hit = torch.zeros(H * (W + 1), dtype=torch.bool, device=free.device)
+    hit[run[seed & free]] = True
+    return hit[run] & free
+
+
 def fillHole(segMask):
+    """
+    Fill the holes of a (H, W) boolean tensor, i.e. background that is not
+    4-connected to the image border (as cv2.floodFill from the padded corner).
+
+    The background reached from the border is spread along row runs and
+    column runs in turn until it stops growing, so the mask stays on its
+    device.
+    """
     h, w = segMask.shape
-    h += 2
-    w += 2
-    _mask = np.pad(segMask, ((1, 1), (1, 1)))
-    im_floodfill = 255 * (_mask.astype(np.uint8)).copy()
-    mask = np.zeros((h + 2, w + 2), dtype=np.uint8)
-    cv2.floodFill(im_floodfill, mask, seedPoint=(0, 0), newVal=255)
-    result = (segMask + (~im_floodfill)[1:-1, 1:-1]).astype(bool)
-    return result
+    free = torch.ones((h + 2, w + 2), dtype=torch.bool, device=segMask.device)
+    free[1:-1, 1:-1] = ~segMask
+    reach = torch.zeros_like(free)
+    reach[[0, -1], :] = True
+    reach[:, [0, -1]] = True
+    while True:
+        grown = spread_along_rows(reach, free)
+        grown = spread_along_rows(grown.T, free.T).T
+        if torch.equal(grown, reach):
+            break
+        reach = grown
+    return segMask | ~reach[1:-1, 1:-1]
 
 
 def extract_boundary(
@@ -124,15 +233,13 @@ def extract_boundary(
     device,
 ):
     seg_mask = (10**target > thresh_target_exp) + (10**Y_raw_full > thresh_result_0_exp)
-    seg_mask = fillHole(seg_mask[0, 0])[None, None]
-    seg_mask = torch.from_numpy(seg_mask).to(device).to(torch.float)
+    seg_mask = fillHole(seg_mask[0, 0])[None, None].to(torch.float)
     seg_mask_large = F.max_pool2d(seg_mask, (1, 49), padding=(0, 24), stride=(1, 1))
     seg_mask_small = -F.max_pool2d(-seg_mask, (1, 49), padding=(0, 24), stride=(1, 1))
     mask = (seg_mask_large + seg_mask_small) == 1
 
     seg_mask = (target > thresh_target) + (Y_raw_full > thresh_result_0)
-    seg_mask = fillHole(seg_mask[0, 0])[None, None]
-    seg_mask = torch.from_numpy(seg_mask).to(device).to(torch.float)
+    seg_mask = fillHole(seg_mask[0, 0])[None, None].to(torch.float)
     seg_mask_large = F.max_pool2d(seg_mask, (1, 49), padding=(0, 24), stride=(1, 1))
     seg_mask_small = -F.max_pool2d(-seg_mask, (1, 49), padding=(0, 24), stride=(1, 1))
     mask1 = (seg_mask_large + seg_mask_small) == 1
@@ -153,10 +260,52 @@ def mask_with_higher_intensity(
     return mask1 + mask2
 
 
+class PostSolver:
+    """
+    Epoch iterator for the post-processing optimizations.
+
+    Stops early once ``update`` reports a converged loss (see ConvergenceMonitor,
+    ``tol=0`` runs all ``n_epochs``), and adds the number of runs, epochs and
+    seconds to ``timings[name]``, if given.
+    """
+
+    def __init__(
+        self,
+        n_epochs,
+        desc="",
+        name="",
+        tol=0,
+        window=20,
+        min_epochs=50,
+        timings=None,
+    ):
+        self.n_epochs, self.desc, self.name = n_epochs, desc, name
+        self.monitor = ConvergenceMonitor(tol, window, min_epochs)
+        self.timings = timings
+        self.converged = False
+
+    def __iter__(self):
+        t0 = time.perf_counter()
+        e = -1
+        for e in tqdm.tqdm(range(self.n_epochs), leave=False, desc=self.desc):
+            yield e
+            if self.converged:
+                break
+        if self.timings is not None:
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            t = self.timings.setdefault(self.name, [0, 0, 0.0])
+            t[0], t[1], t[2] = t[0] + 1, t[1] + e + 1, t[2] + time.perf_counter() - t0
+
+    def update(self, e, l):
+        self.converged = self.monitor(e, l)
+
+
 class stripe_post(nn.Module):
-    def __init__(self, m, n):
+    def __init__(self, m, n, k=1):
         super().__init__()
-        self.w = nn.Parameter(torch.ones(1, 1, m, n))
+        # one independent set of weights per batch element
+        self.w = nn.Parameter(torch.ones(k, 1, m, n))
         self.softplus = nn.Softplus()
 
     def forward(self, b):
@@ -166,9 +315,9 @@ class stripe_post(nn.Module):
 
 
 class compose_post(nn.Module):
-    def __init__(self, m, n):
+    def __init__(self, m, n, k=1):
         super().__init__()
-        self.w = nn.Parameter(0.5 * torch.ones(1, 1, 1, n))
+        self.w = nn.Parameter(0.5 * torch.ones(k, 1, 1, n))
         self.sigmoid = nn.Sigmoid()
 
     def forward(self, b_up, b_bottom, hX, boundary_mask):
@@ -379,26 +528,35 @@ def train_post_process_module(
     non_positive,
     allow_stripe_deviation,
     desc="",
+    n_epochs_compose=1000,
+    solver=None,
 ):
+    # inputs may hold B independent sub-problems along the batch dimension.
+    # they, and the positive and non-positive stripes of each, are optimised
+    # jointly: the losses add up and every sub-problem has its own weights.
+    solver = {} if solver is None else solver
     m, n = hX[:, :, ::r, :].shape[-2:]
 
-    b_sparse_0 = (
+    b_sparse = [
         torch.clip(
             torch.diff(b[:, :, ::r, :], dim=-2, prepend=b[:, :, 0:1, :]),
             0.0,
             None,
         )
         * (1 - missing_mask)[:, :, ::r, :]
-    )
-    model_0 = stripe_post(m, n).to(device)
+    ]
 
     if not non_positive:
-        b_sparse_1 = torch.clip(
-            torch.diff(b[:, :, ::r, :], dim=-2, prepend=b[:, :, 0:1, :]),
-            None,
-            0.0,
+        b_sparse.append(
+            torch.clip(
+                torch.diff(b[:, :, ::r, :], dim=-2, prepend=b[:, :, 0:1, :]),
+                None,
+                0.0,
+            )
         )
-        model_1 = stripe_post(m, n).to(device)
+    K = len(b_sparse)
+    b_sparse = torch.cat(b_sparse, 0)
+    model = stripe_post(m, n, b_sparse.shape[0]).to(device)
 
     weight_tvx = valid_mask[:, :, ::r, :]
     valid_mask_for_preserve = valid_mask * foreground
@@ -412,11 +570,11 @@ def train_post_process_module(
     weight_tvx_hr = weight_tvx_hr[..., 3:-3, 3:-3]
 
     loss = loss_post(
-        weight_tvx,
-        weight_tvy,
-        weight_tvx_f,
-        weight_tvy_f,
-        weight_tvx_hr,
+        weight_tvx.repeat(K, 1, 1, 1),
+        weight_tvy.repeat(K, 1, 1, 1),
+        weight_tvx_f.repeat(K, 1, 1, 1),
+        weight_tvy_f.repeat(K, 1, 1, 1),
+        weight_tvx_hr.repeat(K, 1, 1, 1),
         allow_stripe_deviation=allow_stripe_deviation,
     ).to(device)
 
@@ -431,61 +589,50 @@ def train_post_process_module(
         torch.conv2d(hX[:, :, ::r, :], loss.kernel_y),
         h_mask,
     )
+    h_mask = h_mask.repeat(K, 1, 1, 1)
 
     peusdo_recon = torch.maximum((hX + b), hX)
     peusdo_recon = peusdo_recon * fusion_mask + hX * (1 - fusion_mask)
     peusdo_recon = peusdo_recon[:, :, ::r, :]
 
-    if non_positive:
-        opt = Adam(model_0.parameters(), lr=1)
-    else:
-        opt = Adam([*model_0.parameters(), *model_1.parameters()], lr=1)
+    hX_k = hX.repeat(K, 1, 1, 1)
+    opt = Adam(model.parameters(), lr=1)
 
-    for e in tqdm.tqdm(
-        range(n_epochs), leave=False, desc="post-process stripes {}: ".format(desc)
-    ):
-        b_new_0 = model_0(
-            b_sparse_0,
+    post_solver = PostSolver(
+        n_epochs,
+        "post-process stripes {}: ".format(desc),
+        "stripes",
+        **solver,
+    )
+    for e in post_solver:
+        b_new = model(
+            b_sparse,
         )
         l = loss(
-            F.interpolate(b_new_0, hX.shape[-2:], mode="bilinear", align_corners=True)
-            + hX,
-            hX,
+            F.interpolate(b_new, hX.shape[-2:], mode="bilinear", align_corners=True)
+            + hX_k,
+            hX_k,
             h_mask,
             r,
         )
-        if not non_positive:
-            b_new_1 = model_1(
-                b_sparse_1,
-            )
-            l = l + +loss(
-                F.interpolate(
-                    b_new_1, hX.shape[-2:], mode="bilinear", align_corners=True
-                )
-                + hX,
-                hX,
-                h_mask,
-                r,
-            )
         opt.zero_grad()
         l.backward()
         opt.step()
-
-    if non_positive:
-        b_new = b_new_0
-    else:
-        b_new = torch.cat((b_new_0, b_new_1), 0)
+        post_solver.update(e, l)
 
     guidedfilterloss = GuidedFilterLoss(
-        torch.zeros_like(filled_mask[:, :, ::r, :]), 49, r, 10
+        torch.zeros_like(filled_mask[:1, :, ::r, :]), 49, r, 10
     )
+    fusion_mask_k = fusion_mask.repeat(K, 1, 1, 1)
     b_new = edge_padding_xy(b_new[..., 3:-3, 3:-3], 3, 3)
-    b_new = b_new * fusion_mask[:, :, ::r, :] + torch.zeros_like(b_new) * (
-        1 - fusion_mask[:, :, ::r, :]
+    b_new = b_new * fusion_mask_k[:, :, ::r, :] + torch.zeros_like(b_new) * (
+        1 - fusion_mask_k[:, :, ::r, :]
     )
     b_new = b_new.detach()
 
-    diff = guidedfilterloss((hX[:, :, ::r, :] + b_new.detach() - peusdo_recon))
+    diff = guidedfilterloss(
+        (hX_k[:, :, ::r, :] + b_new.detach() - peusdo_recon.repeat(K, 1, 1, 1))
+    )
 
     b_new = b_new - diff.detach()
 
@@ -496,28 +643,31 @@ def train_post_process_module(
         align_corners=True,
     )
 
-    recon = (hX + b_new).detach()
+    recon = (hX_k + b_new).detach()
 
     if not non_positive:
-        recon_dark, recon_bright = recon[:, None]
-        model = compose_post(hX.shape[-2], hX.shape[-1]).to(device)
+        recon_dark, recon_bright = recon.reshape(K, -1, *recon.shape[1:])
+        model = compose_post(hX.shape[-2], hX.shape[-1], hX.shape[0]).to(device)
         opt = Adam(model.parameters(), lr=1)
         mask = valid_mask * (1 - missing_mask)
         loss = loss_compose_post(mask).to(device)
-        for e in tqdm.tqdm(
-            range(1000),
-            leave=False,
-            desc="merge positive and non-positive stripe {}: ".format(desc),
-        ):
+        post_solver = PostSolver(
+            n_epochs_compose,
+            "merge positive and non-positive stripe {}: ".format(desc),
+            "merge positive and non-positive",
+            **solver,
+        )
+        for e in post_solver:
             recon = model(recon_dark - hX, recon_bright - hX, hX, boundary_mask)
             l = loss(recon, hX, r)
             opt.zero_grad()
             l.backward()
             opt.step()
+            post_solver.update(e, l)
     else:
         recon = (
             (1 - boundary_mask) * (recon - hX)
-            + boundary_mask * torch.maximum(*(recon - hX), torch.zeros_like(hX))
+            + boundary_mask * torch.maximum(recon - hX, torch.zeros_like(hX))
             + hX
         )
 
@@ -525,8 +675,7 @@ def train_post_process_module(
 
 
 def uniform_fusion_mask(fusion_mask, angle_list, illu_orient, device):
-    if isinstance(fusion_mask, np.ndarray):
-        fusion_mask = torch.from_numpy(fusion_mask).to(device)
+    fusion_mask = as_tensor(fusion_mask, device)
     m, n = fusion_mask.shape[-2:]
     for angle in angle_list:
         fusion_mask = rotate(fusion_mask, -angle, expand=True)
@@ -545,7 +694,7 @@ def uniform_fusion_mask(fusion_mask, angle_list, illu_orient, device):
             fusion_mask = torch.cumsum(fusion_mask > 0, -2) > 0
             fusion_mask = fusion_mask.to(torch.float)
         fusion_mask = crop_center(rotate(fusion_mask, angle, expand=True), m, n)
-    return fusion_mask.cpu().data.numpy()
+    return fusion_mask
 
 
 def padding_size(H, W, angle):
@@ -571,23 +720,36 @@ def linear_propagation(
     non_positive=False,
     r=10,
     desc="",
+    n_epochs_compose=1000,
+    solver=None,
 ):
+    solver = {} if solver is None else solver
 
     m0, n0 = hX.shape[-2:]
 
-    hX0 = copy.deepcopy(hX)
-
-    foreground = torch.from_numpy(foreground).to(device)
-    fusion_mask = torch.from_numpy(fusion_mask).to(device)
-    b = torch.from_numpy(b).to(device)
-    hX = torch.from_numpy(hX).to(device)
-
-    foreground = rotate(foreground, -angle_offset) > 0
-    fusion_mask = rotate(fusion_mask, -angle_offset)
-    valid_mask = rotate(torch.ones_like(hX), -angle_offset) > 0
-    missing_mask = rotate(missing_mask, -angle_offset) > 0
-    boundary_mask = rotate(boundary_mask, -angle_offset) > 0
-    filled_mask = rotate(filled_mask, -angle_offset) > 0
+    (
+        foreground,
+        fusion_mask,
+        valid_mask,
+        missing_mask,
+        boundary_mask,
+        filled_mask,
+    ) = rotate_many(
+        [
+            foreground,
+            fusion_mask,
+            torch.ones_like(hX),
+            missing_mask,
+            boundary_mask,
+            filled_mask,
+        ],
+        -angle_offset,
+    )
+    foreground = foreground > 0
+    valid_mask = valid_mask > 0
+    missing_mask = missing_mask > 0
+    boundary_mask = boundary_mask > 0
+    filled_mask = filled_mask > 0
 
     H_new, W_new = padding_size(
         foreground.shape[-2], foreground.shape[-1], np.abs(angle_offset)
@@ -596,19 +758,12 @@ def linear_propagation(
     hX = edge_padding_xy(
         hX, int(H_new - hX.shape[-2]) // 2 + 1, int(W_new - hX.shape[-1]) // 2 + 1
     )
-    hX = crop_center(
-        rotate(hX, -angle_offset, expand=False),
-        foreground.shape[-2],
-        foreground.shape[-1],
-    )
-
     b = edge_padding_xy(
         b, int(H_new - b.shape[-2]) // 2 + 1, int(W_new - b.shape[-1]) // 2 + 1
     )
-    b = crop_center(
-        rotate(b, -angle_offset, expand=False),
-        foreground.shape[-2],
-        foreground.shape[-1],
+    hX, b = (
+        crop_center(x, foreground.shape[-2], foreground.shape[-1])
+        for x in rotate_many([hX, b], -angle_offset, expand=False)
     )
 
     m, n = b[:, :, ::r, :].shape[-2:]
@@ -622,88 +777,63 @@ def linear_propagation(
     filled_mask = filled_mask + 0.0
 
     if fusion_mask.sum() == 0:
-        return np.zeros(
-            (
-                1,
-                1,
-                m0,
-                n0,
-            ),
-            dtype=np.float32,
-        )
-
+        return torch.zeros((1, 1, m0, n0), dtype=hX.dtype, device=hX.device)
+
+    def crop_range(fusion_mask, valid_mask):
+        rows = nonzero_range(fusion_mask, -2) or (0, 0)
+        cols = nonzero_range(fusion_mask * valid_mask, -1) or (hX.shape[-1], 0)
+        s = min(rows[1] + 3, hX.shape[-2])
+        c0 = max(cols[0] - 3, 0)
+        c1 = min(cols[1] + 3, hX.shape[-1])
+        return s, c0, c1
+
+    # bottom illumination is solved as top illumination of the flipped view.
+    # for top-bottom, both are cropped alike and solved as one batch
+    views = []
     if "top" in illu_orient:
-        s = min(last_nonzero(fusion_mask, None, -2, 0).max() + 3, hX.shape[-2])
-        c0 = max(
-            first_nonzero(fusion_mask * valid_mask, None, -1, hX.shape[-1]).min() - 3, 0
-        )
-        c1 = min(
-            last_nonzero(fusion_mask * valid_mask, None, -1, 0).max() + 3, hX.shape[-1]
-        )
-        recon_up = train_post_process_module(
-            hX[..., :s, c0:c1],
-            b[..., :s, c0:c1],
-            valid_mask[..., :s, c0:c1] * fusion_mask[..., :s, c0:c1],
-            missing_mask[..., :s, c0:c1],
-            fusion_mask[..., :s, c0:c1],
-            foreground[..., :s, c0:c1],
-            boundary_mask[..., :s, c0:c1],
-            filled_mask[..., :s, c0:c1],
-            n_epochs,
-            r,
-            device,
-            non_positive=non_positive,
-            allow_stripe_deviation=allow_stripe_deviation,
-            desc=desc,
-        )
-        recon_up = F.pad(recon_up, (c0, n - (c1 - c0) - c0, 0, hX.shape[-2] - s))
-
+        views.append(False)
     if "bottom" in illu_orient:
-        b = torch.flip(b, [-2])
-        valid_mask = torch.flip(valid_mask, [-2])
-        hX = torch.flip(hX, [-2])
-        missing_mask = torch.flip(missing_mask, [-2])
-        foreground = torch.flip(foreground, [-2])
-        fusion_mask = torch.flip(fusion_mask, [-2])
-        boundary_mask = torch.flip(boundary_mask, [-2])
-        filled_mask = torch.flip(filled_mask, [-2])
-
-        s = min(last_nonzero(fusion_mask, None, -2, 0).max() + 3, hX.shape[-2])
-        c0 = max(
-            first_nonzero(fusion_mask * valid_mask, None, -1, hX.shape[-1]).min() - 3, 0
-        )
-        c1 = min(
-            last_nonzero(fusion_mask * valid_mask, None, -1, 0).max() + 3, hX.shape[-1]
-        )
-
-        recon_bottom = train_post_process_module(
-            hX[..., :s, c0:c1],
-            b[..., :s, c0:c1],
-            valid_mask[..., :s, c0:c1] * fusion_mask[..., :s, c0:c1],
-            missing_mask[..., :s, c0:c1],
-            fusion_mask[..., :s, c0:c1],
-            foreground[..., :s, c0:c1],
-            boundary_mask[..., :s, c0:c1],
-            filled_mask[..., :s, c0:c1],
-            n_epochs,
-            r,
-            device,
-            non_positive=non_positive,
-            allow_stripe_deviation=allow_stripe_deviation,
-            desc=desc,
-        )
-
-        recon_bottom = F.pad(
-            recon_bottom, (c0, n - (c1 - c0) - c0, 0, hX.shape[-2] - s)
-        )
-
-        hX = torch.flip(hX, [-2])
-        fusion_mask = torch.flip(fusion_mask, [-2])
-        valid_mask = torch.flip(valid_mask, [-2])
-        missing_mask = torch.flip(missing_mask, [-2])
-        foreground = torch.flip(foreground, [-2])
-        recon_bottom = torch.flip(recon_bottom, [-2])
-        boundary_mask = torch.flip(boundary_mask, [-2])
+        views.append(True)
+    crops = [
+        crop_range(
+            torch.flip(fusion_mask, [-2]) if flip else fusion_mask,
+            torch.flip(valid_mask, [-2]) if flip else valid_mask,
+        )
+        for flip in views
+    ]
+    s = max(crop[0] for crop in crops)
+    c0 = min(crop[1] for crop in crops)
+    c1 = max(crop[2] for crop in crops)
+
+    def stack(x):
+        return torch.cat(
+            [torch.flip(x, [-2]) if flip else x for flip in views], 0
+        )[..., :s, c0:c1]
+
+    recon = train_post_process_module(
+        stack(hX),
+        stack(b),
+        stack(valid_mask) * stack(fusion_mask),
+        stack(missing_mask),
+        stack(fusion_mask),
+        stack(foreground),
+        stack(boundary_mask),
+        stack(filled_mask),
+        n_epochs,
+        r,
+        device,
+        non_positive=non_positive,
+        allow_stripe_deviation=allow_stripe_deviation,
+        desc=desc,
+        n_epochs_compose=n_epochs_compose,
+        solver=solver,
+    )
+    recon = F.pad(recon, (c0, n - (c1 - c0) - c0, 0, hX.shape[-2] - s))
+    for k, flip in enumerate(views):
+        if flip:
+            recon_bottom = torch.flip(recon[k : k + 1], [-2])
+        else:
+            recon_up = recon[k : k + 1]
 
     if illu_orient == "top-bottom":
         recon_up = recon_up.detach()
@@ -713,32 +843,33 @@ def linear_propagation(
         mask = valid_mask * fusion_mask
         loss = loss_compose_post(mask).to(device)
 
-        for e in tqdm.tqdm(
-            range(1000), leave=False, desc="merge top-bottom ill. {}: ".format(desc)
-        ):
+        post_solver = PostSolver(
+            n_epochs_compose,
+            "merge top-bottom ill. {}: ".format(desc),
+            "merge top-bottom",
+            **solver,
+        )
+        for e in post_solver:
             recon = model(recon_up - hX, recon_bottom - hX, hX, boundary_mask)
             l = loss(recon, hX, r)
             opt.zero_grad()
             l.backward()
             opt.step()
+            post_solver.update(e, l)
 
     if illu_orient == "top":
         recon = recon_up
     if illu_orient == "bottom":
         recon = recon_bottom
 
-    recon = (
-        crop_center(
-            rotate(
-                recon,
-                angle_offset,
-                expand=True,
-            ),
-            m0,
-            n0,
-        )
-        .cpu()
-        .data.numpy()
+    recon = crop_center(
+        rotate(
+            recon,
+            angle_offset,
+            expand=True,
+        ),
+        m0,
+        n0,
     )
 
     return recon
@@ -756,24 +887,67 @@ def post_process_module(
     non_positive=False,
     r=10,
     n_epochs=1000,
+    n_epochs_compose=1000,
+    solver=None,
 ):
+    # n_epochs caps the stripe fits, n_epochs_compose the merging steps;
+    # solver holds PostSolver arguments (tol, window, min_epochs, timings).
+    # inputs may be arrays or tensors; all work stays on device, and only the
+    # result is returned as an array
     if device == None:
         device = "cuda" if torch.cuda.is_available() else "cpu"
+    hX, result_gu, result_gnn = (
+        as_tensor(x, device) for x in (hX, result_gu, result_gnn)
+    )
     if hX.shape[1] > 1:
         assert fusion_mask is not None, print("fusion_mask is missing.")
         assert len(angle_offset_individual) > 1, print(
             "angle_offset_individual must be of length 2."
         )
         fusion_mask = fusion_mask[:, :, : hX.shape[-2], : hX.shape[-1]]
+    if fusion_mask is None:
+        fusion_mask = torch.ones_like(hX)
+    fusion_mask = as_tensor(fusion_mask, device)
 
-    hX0 = copy.deepcopy(hX)
-    hX0 = np.where(hX0 == 0, hX0.max(1, keepdims=True), hX0)
-    target = np.log10(np.clip(((10**hX0) * fusion_mask).sum(1, keepdims=True), 1, None))
+    hX0 = torch.where(hX == 0, hX.amax(1, keepdim=True), hX)
+    target = torch.log10(((10**hX0) * fusion_mask).sum(1, keepdim=True).clip(min=1))
     recon = []
 
     iex = 1
     count = lambda lst: sum(count(x) if isinstance(x, list) else 1 for x in lst)
     iex_total = count(angle_offset_individual)
+    # neither target nor result_gnn change across views, so the thresholds
+    # and masks are computed once per slice
+    thresh_target_exp, thresh_target = otsu_thresholds(target)
+    thresh_result_gnn_exp, thresh_result_gnn = otsu_thresholds(result_gnn)
+    foreground = (10**target > thresh_target_exp) + (
+        10**result_gu > thresh_result_gnn_exp
+    )
+    missing_mask = mask_with_lower_intensity(
+        result_gnn,
+        target,
+        thresh_target_exp,
+        thresh_target,
+        thresh_result_gnn_exp,
+        thresh_result_gnn,
+    )
+    boundary_mask = extract_boundary(
+        result_gnn,
+        target,
+        thresh_target_exp,
+        thresh_target,
+        thresh_result_gnn_exp,
+        thresh_result_gnn,
+        device,
+    )
+    filled_mask = mask_with_higher_intensity(
+        result_gnn,
+        target,
+        thresh_target_exp,
+        thresh_target,
+        thresh_result_gnn_exp,
+        thresh_result_gnn,
+    )
     for ind, (angle_list, illu) in enumerate(zip(angle_offset_individual, illu_orient)):
         fusion_mask_ind = uniform_fusion_mask(
             fusion_mask[:, ind : ind + 1],
@@ -782,42 +956,6 @@ def post_process_module(
             device=device,
         )
         hX = hX0[:, ind : ind + 1, ...]
-
-        thresh_target_exp = threshold_otsu(10**target)
-        thresh_target = threshold_otsu(target)
-        thresh_result_gnn_exp = threshold_otsu(10**result_gnn)
-        thresh_result_gnn = threshold_otsu(result_gnn)
-
-        foreground = (10**target > thresh_target_exp) + (
-            10**result_gu > thresh_result_gnn_exp
-        )
-        result_gnn_torch = torch.from_numpy(result_gnn).to(device)
-        target_torch = torch.from_numpy(target).to(device)
-        missing_mask = mask_with_lower_intensity(
-            result_gnn_torch,
-            target_torch,
-            thresh_target_exp,
-            thresh_target,
-            thresh_result_gnn_exp,
-            thresh_result_gnn,
-        )
-        boundary_mask = extract_boundary(
-            result_gnn,
-            target,
-            thresh_target_exp,
-            thresh_target,
-            thresh_result_gnn_exp,
-            thresh_result_gnn,
-            device,
-        )
-        filled_mask = mask_with_higher_intensity(
-            result_gnn_torch,
-            target_torch,
-            thresh_target_exp,
-            thresh_target,
-            thresh_result_gnn_exp,
-            thresh_result_gnn,
-        )
         for i, angle in enumerate(angle_list):
             hX = linear_propagation(
                 result_gu - hX0[:, ind : ind + 1, ...],
@@ -834,14 +972,16 @@ def post_process_module(
                 allow_stripe_deviation=allow_stripe_deviation,
                 r=r,
                 n_epochs=n_epochs,
+                n_epochs_compose=n_epochs_compose,
+                solver=solver,
                 desc="(No. {} out of {} angles)".format(iex, iex_total),
             )
             iex += 1
         recon.append(hX)
 
-    recon = np.concatenate(recon, 1)
+    recon = torch.cat(recon, 1)
     recon = (recon * fusion_mask).sum(
         1,
-        keepdims=True,
+        keepdim=True,
     )
-    return recon
+    return recon.cpu().numpy()
@@ -18,31 +18,83 @@ import os
 import tqdm
 import tifffile
 import gc
+import contextlib
+import queue
+import threading
+import hashlib
 
 
-def finalize_save(result_npy, done_npy, save_path):
+def finalize_save(
+    result_npy,
+    done_npy,
+    save_path,
+    compression=None,
+    maxworkers=None,
+    correct=False,
+):
+    """
+    Write the finished slices of the work memmap to ``save_path``.
+
+    Slices are streamed page by page, so that only one slice is held in
+    memory at a time. BigTIFF is used when the output exceeds the 4 GB
+    limit of classic TIFF.
 
+    Parameters:
+    ---------------------
+    correct: bool
+        whether to apply global_correction on the fly, using the per-slice
+        statistics saved next to the work memmap. Only applied to a complete
+        volume of more than one slice.
+    compression: str or None
+        compression passed to tifffile, e.g. 'zlib' or 'zstd'
+    maxworkers: int or None
+        number of threads used by tifffile to compress each page
+    """
     result_mm = np.lib.format.open_memmap(result_npy, mode="r")
     done_mm = np.lib.format.open_memmap(done_npy, mode="r")
 
     done = np.asarray(done_mm, dtype=bool)
-    k_done = int(done.sum())
+    complete = bool(done.all())
+    # slices can finish out of order, only the leading finished run is written
+    k_done = done.size if complete else int(np.argmin(done))
 
     if k_done == 0:
         return
 
-    view = result_mm[:k_done]
-    arr = np.asarray(view)
-    tifffile.imwrite(
-        save_path,
-        arr,
-        photometric="minisblack",
-    )
+    shape = (k_done,) + result_mm.shape[1:]
+    bigtiff = np.prod(shape) * result_mm.dtype.itemsize > 2**32 - 2**25
+
+    stats_npy = done_npy.replace("__done.npy", "__stats.npy")
+    params = None
+    if correct and complete and (done.size > 1) and os.path.exists(stats_npy):
+        stats = np.load(stats_npy)
+        params = global_correction_params(stats[:, 0], stats[:, 1], stats[:, 2])
+
+    def pages():
+        for i in tqdm.tqdm(range(k_done), desc="saving: ", leave=False):
+            if params is None:
+                yield np.asarray(result_mm[i])
+            else:
+                yield apply_global_correction(result_mm[i], i, params)
+
+    with tifffile.TiffWriter(save_path, bigtiff=bigtiff) as tif:
+        tif.write(
+            pages(),
+            shape=shape,
+            dtype=result_mm.dtype,
+            photometric="minisblack",
+            compression=compression,
+            maxworkers=maxworkers,
+        )
 
     del result_mm, done_mm
     gc.collect()
 
-    for p in (result_npy, done_npy):
+    if not complete:
+        # keep the work files of an interrupted run, so that it can be resumed
+        return
+
+    for p in (result_npy, done_npy, stats_npy):
         try:
             os.remove(p)
         except FileNotFoundError:
@@ -55,11 +107,40 @@ def finalize_save(result_npy, done_npy, save_path):
                 pass
 
 
-def open_or_init_mm(save_dir, stem, z, m, n):
+def open_or_init_mm(save_dir, stem, z, m, n, resume=False):
     mm_path = os.path.join(save_dir, f"{stem}__work.npy")
     done_path = os.path.join(save_dir, f"{stem}__done.npy")
+    stats_path = os.path.join(save_dir, f"{stem}__stats.npy")
 
-    for path in (mm_path, done_path):
+    if resume and os.path.exists(mm_path) and os.path.exists(done_path):
+        result_mm = np.lib.format.open_memmap(mm_path, mode="r+")
+        done_mm = np.lib.format.open_memmap(done_path, mode="r+")
+        if (result_mm.shape == (z, m, n)) and (done_mm.shape == (z,)):
+            if os.path.exists(stats_path):
+                stats_mm = np.lib.format.open_memmap(stats_path, mode="r+")
+            else:
+                stats_mm = np.lib.format.open_memmap(
+                    stats_path, mode="w+", dtype=np.float64, shape=(z, 3)
+                )
+                for i in np.where(done_mm)[0]:
+                    out_slice = np.asarray(result_mm[i])
+                    stats_mm[i] = (
+                        np.mean(out_slice + 0.1),
+                        out_slice.min(),
+                        out_slice.max(),
+                    )
+                stats_mm.flush()
+            print(
+                "resume from {} out of {} finished slices.".format(
+                    int((done_mm > 0).sum()), z
+                )
+            )
+            return result_mm, done_mm, stats_mm
+        print("existing work files do not match the input volume, start over.")
+        del result_mm, done_mm
+        gc.collect()
+
+    for path in (mm_path, done_path, stats_path):
         if os.path.exists(path):
             os.remove(path)
 
@@ -69,13 +150,316 @@ def open_or_init_mm(save_dir, stem, z, m, n):
     done_mm = np.lib.format.open_memmap(
         done_path, mode="w+", dtype=np.uint8, shape=(z,)
     )
+    stats_mm = np.lib.format.open_memmap(
+        stats_path, mode="w+", dtype=np.float64, shape=(z, 3)
+    )
 
     done_mm[:] = 0
 
     result_mm.flush()
     done_mm.flush()
+    stats_mm.flush()
+
+    return result_mm, done_mm, stats_mm
+
+
+class SlicePrefetcher:
+    """
+    Iterate over ``(item, load_fn(item))`` while a background thread loads
+    the next items.
+
+    At most ``depth`` loaded items are kept ahead of the consumer, which
+    bounds the memory used by the prefetched slices. ``depth=0`` loads
+    synchronously. Exceptions raised while loading are re-raised in the
+    consuming thread.
+    """
+
+    _end = object()
+
+    def __init__(
+        self,
+        load_fn,
+        items,
+        depth: int = 1,
+    ):
+        self.load_fn = load_fn
+        self.items = list(items)
+        self.depth = int(depth)
+
+    def __iter__(self):
+        if self.depth <= 0:
+            for item in self.items:
+                yield item, self.load_fn(item)
+            return
 
-    return result_mm, done_mm
+        q = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+
+        def put(x):
+            while not stop.is_set():
+                try:
+                    q.put(x, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def producer():
+            try:
+                for item in self.items:
+                    if not put((item, self.load_fn(item), None)):
+                        return
+            except Exception as e:
+                put((None, None, e))
+                return
+            put(self._end)
+
+        thread = threading.Thread(target=producer, daemon=True)
+        thread.start()
+        try:
+            while True:
+                out = q.get()
+                if out is self._end:
+                    return
+                item, data, e = out
+                if e is not None:
+                    raise e
+                yield item, data
+        finally:
+            stop.set()
+            thread.join()
+
+
+def bucket_size(
+    x,
+    bucket,
+):
+    """
+    Round ``x`` up to a multiple of ``bucket``, so that slightly different
+    acquisitions share one compiled pipeline.
+    """
+    if not bucket:
+        return x
+    return -(-x // bucket) * bucket
+
+
+def tile_offsets(
+    length,
+    tile_size,
+    overlap,
+):
+    """
+    Start offsets of overlapping tiles of width ``tile_size`` covering ``length``.
+
+    The last tile is aligned to the end, so that all tiles have the same width
+    and can share one pipeline. Returns None if no tiling is needed.
+    """
+    if (tile_size is None) or (tile_size >= length):
+        return None
+    step = max(1, tile_size - overlap)
+    return list(range(0, length - tile_size, step)) + [length - tile_size]
+
+
+def tile_view(
+    arr,
+    t0,
+    tile_size,
+    axis,
+):
+    # lazy for dask arrays and memmaps
+    if (arr is None) or (t0 is None):
+        return arr
+    if axis == -1:
+        return arr[..., t0 : t0 + tile_size]
+    return arr[..., t0 : t0 + tile_size, :]
+
+
+def preview_view(
+    arr,
+    inds,
+    factor,
+    reduce=np.mean,
+):
+    """
+    Read the slices ``inds`` of ``arr`` and shrink their last two axes
+    by ``factor``, reducing every factor x factor block with ``reduce``.
+    """
+    if arr is None:
+        return arr
+    arr = np.asarray(arr[list(inds)])
+    factor = max(1, int(factor))
+    if factor == 1:
+        return arr
+    m, n = arr.shape[-2] // factor, arr.shape[-1] // factor
+    arr = arr[..., : m * factor, : n * factor]
+    arr = arr.reshape(arr.shape[:-2] + (m, factor, n, factor))
+    return reduce(arr, axis=(-3, -1)).astype(arr.dtype)
+
+
+class TileBlender:
+    """
+    Blend destriped tiles back into full slices.
+
+    Tiles are weighted by a linear ramp over ``overlap`` pixels at their
+    borders along ``axis``. A slice is returned once all of its tiles
+    have been added, so that only slices in flight are kept in memory.
+    """
+
+    def __init__(
+        self,
+        shape,
+        tiles,
+        tile_size,
+        overlap,
+        axis,
+    ):
+        self.shape, self.tiles = shape, list(tiles)
+        self.tile_size, self.axis = tile_size, axis
+        ramp = np.minimum(np.arange(tile_size) + 1, tile_size - np.arange(tile_size))
+        ramp = np.clip(ramp / max(1, overlap), None, 1).astype(np.float32)
+        self.weight = ramp[None, :] if axis == -1 else ramp[:, None]
+        self.tile_shape = (
+            (shape[0], tile_size) if axis == -1 else (tile_size, shape[1])
+        )
+        self.pending = {}
+
+    def add(
+        self,
+        i,
+        t0,
+        Y,
+        target,
+    ):
+        if i not in self.pending:
+            self.pending[i] = {
+                "Y": np.zeros(self.shape, dtype=np.float32),
+                "target": np.zeros(self.shape, dtype=np.float32),
+                "weight": np.zeros(self.shape, dtype=np.float32),
+                "tiles": set(),
+            }
+        acc = self.pending[i]
+        if self.axis == -1:
+            sl = (slice(None), slice(t0, t0 + self.tile_size))
+        else:
+            sl = (slice(t0, t0 + self.tile_size), slice(None))
+        for key, x in (("Y", Y), ("target", target)):
+            x = x[: self.tile_shape[0], : self.tile_shape[1]]
+            x = np.pad(
+                x,
+                (
+                    (0, self.tile_shape[0] - x.shape[0]),
+                    (0, self.tile_shape[1] - x.shape[1]),
+                ),
+                mode="edge",
+            )
+            acc[key][sl] += x * self.weight
+        acc["weight"][sl] += self.weight
+        acc["tiles"].add(t0)
+        if len(acc["tiles"]) < len(self.tiles):
+            return None
+        del self.pending[i]
+        return acc["Y"] / acc["weight"], acc["target"] / acc["weight"]
+
+
+def to_output_slice(Y, m_0, n_0):
+    # crop the padding of shape bucketing, if any
+    out_slice = np.clip(Y[:m_0, :n_0], 0, 65535).astype(np.uint16)
+    return np.pad(
+        out_slice,
+        ((0, m_0 - out_slice.shape[0]), (0, n_0 - out_slice.shape[1])),
+        mode="edge",
+    )
+
+
+def slice_stats(out_slice):
+    # (mean, MIN, MAX) as used by global_correction
+    return np.mean(out_slice + 0.1), out_slice.min(), out_slice.max()
+
+
+def as_picklable(arr):
+    """
+    Replace a .npy-backed memmap by its path and shape, so that worker
+    processes reopen it instead of receiving a full copy.
+    """
+    if isinstance(arr, np.memmap) and (arr.filename is not None):
+        return ("memmap", str(arr.filename), arr.shape)
+    return arr
+
+
+def from_picklable(arr):
+    if isinstance(arr, tuple) and (len(arr) == 3) and (arr[0] == "memmap"):
+        return np.lib.format.open_memmap(arr[1], mode="r").reshape(arr[2])
+    return arr
+
+
+# JAX <-> torch handoffs, counted when LEONARDO_DEBUG is set
+interop_copies = {"dlpack": 0, "copy": 0}
+
+
+def count_interop(kind):
+    if os.environ.get("LEONARDO_DEBUG"):
+        interop_copies[kind] += 1
+
+
+def jax_to_torch(x, device):
+    """
+    Hand a JAX array over to torch on ``device``: a DLPack view of the same
+    buffer when dtype and device allow, otherwise a copy.
+
+    The view shares memory with the (immutable) JAX buffer, so it must not be
+    modified in place.
+    """
+    device = torch.device(device)
+    try:
+        t = torch.from_dlpack(x)
+    except Exception:
+        count_interop("copy")
+        return torch.from_numpy(np.array(x)).to(device)
+    if (t.device.type != device.type) or (
+        (device.index is not None) and (t.device.index != device.index)
+    ):
+        count_interop("copy")
+        return t.to(device)
+    count_interop("dlpack")
+    return t
+
+
+def torch_to_jax(t):
+    """
+    Hand a torch tensor over to JAX, as a DLPack view when possible.
+    """
+    t = t.detach()
+    try:
+        x = jax.dlpack.from_dlpack(t)
+    except Exception:
+        count_interop("copy")
+        return jnp.asarray(t.cpu().numpy())
+    count_interop("dlpack")
+    return x
+
+
+@contextlib.contextmanager
+def limit_threads_env(n_threads):
+    """
+    Temporarily limit the BLAS/OpenMP/XLA thread pools of newly spawned processes.
+    """
+    keys = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "XLA_FLAGS"]
+    backup = {k: os.environ.get(k) for k in keys}
+    for k in keys[:-1]:
+        os.environ[k] = str(n_threads)
+    if n_threads == 1:
+        os.environ["XLA_FLAGS"] = (
+            (backup["XLA_FLAGS"] or "")
+            + " --xla_cpu_multi_thread_eigen=false intra_op_parallelism_threads=1"
+        ).strip()
+    try:
+        yield
+    finally:
+        for k, v in backup.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
 
 
 def ensure_abs_tif(save_path):
@@ -144,9 +528,57 @@ def crop_center(
     return img[..., starty : starty + cropy, startx : startx + cropx]
 
 
-def global_correction(
+def otsu_from_histogram(
+    hist,
+    centers,
+):
+    weight1 = np.cumsum(hist)
+    weight2 = np.cumsum(hist[::-1])[::-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean1 = np.cumsum(hist * centers) / weight1
+        mean2 = (np.cumsum((hist * centers)[::-1]) / weight2[::-1])[::-1]
+    variance12 = weight1[:-1] * weight2[1:] * (mean1[:-1] - mean2[1:]) ** 2
+    return centers[np.nanargmax(variance12)]
+
+
+def otsu_thresholds(
+    x,
+    nbins: int = 1024,
+    stride: int = 1,
+):
+    """
+    Otsu thresholds of a log10-domain image x and of 10**x, taken from one
+    shared histogram of x, so that the exponentiated copy is never formed.
+    The exp-domain threshold is found on the same bins with centers mapped
+    through 10**, and is therefore quantised to the log-domain bins.
+    stride subsamples the two trailing axes before binning. Tensors are
+    binned on their device and only the histogram is copied back.
+
+    Returns (thresh_exp, thresh).
+    """
+    x = x[..., ::stride, ::stride]
+    if isinstance(x, torch.Tensor):
+        x = x.float()
+        lo, hi = x.min().item(), x.max().item()
+        if lo == hi:
+            return 10**lo, lo
+        hist = torch.histc(x, bins=nbins, min=lo, max=hi).cpu().numpy()
+    else:
+        x = np.asarray(x)
+        lo, hi = float(x.min()), float(x.max())
+        if lo == hi:
+            return 10**lo, lo
+        hist, _ = np.histogram(x, bins=nbins, range=(lo, hi))
+    edges = np.linspace(lo, hi, nbins + 1)
+    centers = (edges[:-1] + edges[1:]) / 2
+    return (
+        otsu_from_histogram(hist, 10**centers),
+        otsu_from_histogram(hist, centers),
+    )
+
+
+def global_correction_params(
     mean,
-    result,
     MIN,
     MAX,
 ):
@@ -157,17 +589,45 @@ def global_correction(
     MIN = MIN - mean + means
     MAX = MAX - mean + means
 
-    _min_new = MIN.min()
-    _max_new = MAX.max()
+    return {
+        "mean": np.array(mean),
+        "means": means,
+        "min": _min,
+        "max": _max,
+        "min_new": MIN.min(),
+        "max_new": MAX.max(),
+    }
 
+
+def apply_global_correction(
+    x,
+    i,
+    params,
+):
+    return np.clip(
+        (
+            np.asarray(x)
+            - params["mean"][i]
+            + params["means"][i]
+            + 0.0
+            - params["min_new"]
+        )
+        / (params["max_new"] - params["min_new"])
+        * (params["max"] - params["min"]),
+        0,
+        65535,
+    ).astype(np.uint16)
+
+
+def global_correction(
+    mean,
+    result,
+    MIN,
+    MAX,
+):
+    params = global_correction_params(mean, MIN, MAX)
     for i in tqdm.tqdm(range(result.shape[0]), desc="global correction: ", leave=False):
-        result[i] = np.clip(
-            (np.asarray(result[i]) - mean[i] + means[i] + 0.0 - _min_new)
-            / (_max_new - _min_new)
-            * (_max - _min),
-            0,
-            65535,
-        ).astype(np.uint16)
+        result[i] = apply_global_correction(result[i], i, params)
     getattr(result, "flush", lambda: None)()
 
 
@@ -184,11 +644,252 @@ def destripe_train_params(
     n_neighbors: int = 16,
     gf_mode: int = 1,
     backend: str = "jax",
+    batch_size: int = 1,
+    warm_start: bool = False,
+    warm_start_n_epochs: int = 100,
+    convergence_tol: float = 0,
+    convergence_window: int = 20,
+    min_n_epochs: int = 50,
+    n_workers: int = 1,
+    n_threads_per_worker: int = None,
+    n_prefetch: int = 1,
+    cache_dir: str = None,
+    keyframe_interval: int = 1,
+    keyframe_n_epochs: int = 0,
+    tile_size: int = None,
+    tile_overlap: int = 64,
+    shape_bucket: int = None,
+    torch_compile: bool = False,
+    post_n_epochs: int = 1000,
+    post_n_epochs_compose: int = 1000,
+    post_convergence_tol: float = 0,
 ):
     kwargs = locals()
     return kwargs
 
 
+class ConvergenceMonitor:
+    """
+    Early stopping for the per-slice epoch loop.
+
+    The loss is averaged over consecutive windows of ``window`` epochs.
+    Training is considered converged once the relative change between two
+    consecutive windows is below ``tol`` (for every slice, if the loss is
+    batched) and at least ``min_epochs`` epochs have been run.
+    A non-positive ``tol`` disables early stopping.
+    """
+
+    def __init__(
+        self,
+        tol: float = 0,
+        window: int = 20,
+        min_epochs: int = 50,
+    ):
+        self.tol = tol
+        self.window = max(1, int(window))
+        self.min_epochs = min_epochs
+        self.losses = []
+        self.previous = None
+
+    def __call__(
+        self,
+        epoch,
+        l,
+    ):
+        if self.tol <= 0:
+            return False
+        # keep losses on device and only synchronize once per window
+        self.losses.append(l.detach() if torch.is_tensor(l) else l)
+        if len(self.losses) < self.window:
+            return False
+        current = np.mean(
+            [
+                x.cpu().numpy() if torch.is_tensor(x) else np.asarray(x)
+                for x in self.losses
+            ],
+            0,
+        )
+        self.losses = []
+        previous, self.previous = self.previous, current
+        if (previous is None) or (epoch + 1 < self.min_epochs):
+            return False
+        return bool(np.all(np.abs(current - previous) <= self.tol * np.abs(previous)))
+
+
+def keyframe_schedule(
+    z,
+    interval,
+    done,
+):
+    """
+    Split the slices of a volume into keyframes, trained from scratch, and
+    the slices in between, which reuse the parameters of the nearest keyframe.
+
+    Parameters:
+    ---------------------
+    z: int
+        number of slices
+    interval: int
+        every interval-th slice (and the last one) is a keyframe
+    done: array of shape (z,)
+        slices that are already finished, as in the done memmap
+
+    Returns:
+    ---------------------
+    keyframes: list
+        keyframes to train, i.e., unfinished ones and those still needed
+        by unfinished slices in between
+    followers: dict
+        unfinished slices in between, grouped by their nearest keyframe
+    """
+    keyframes = list(range(0, z, interval))
+    if keyframes[-1] != z - 1:
+        keyframes.append(z - 1)
+    kf = np.asarray(keyframes)
+    followers = {k: [] for k in keyframes}
+    for i in range(z):
+        if done[i] or (i in followers):
+            continue
+        followers[int(kf[np.argmin(np.abs(kf - i))])].append(i)
+    keyframes = [k for k in keyframes if (not done[k]) or followers[k]]
+    return keyframes, {k: item for k, item in followers.items() if item}
+
+
+def stack_slice_data(
+    slice_data,
+    backend,
+):
+    """
+    Stack the per-slice training inputs along a new leading batch axis.
+
+    Parameters:
+    ---------------------
+    slice_data: list of dict
+        training inputs of each slice, as given by DeStripe.prepare_one_slice
+    backend: str
+        'jax' or 'torch'
+    """
+    stack = jnp.stack if backend == "jax" else torch.stack
+    out = {}
+    for key, item in slice_data[0].items():
+        if isinstance(item, dict):
+            out[key] = {k: stack([d[key][k] for d in slice_data]) for k in item}
+        else:
+            out[key] = stack([d[key] for d in slice_data])
+    return out
+
+
+def half_spectrum_index(
+    md,
+    nd,
+):
+    """
+    Index maps between rfft2 and the half spectrum of DeStripeModel, i.e. the
+    first md * nd // 2 entries of the flattened, fftshift-ed spectrum, followed
+    by the DC term (md, nd odd).
+
+    Returns (to_half, to_half_conj, from_half, from_half_conj):
+    the half spectrum is rfft2(x).reshape(-1)[to_half], conjugated where
+    to_half_conj; the flattened (md, nd // 2 + 1) input of irfft2 is
+    half[from_half], conjugated where from_half_conj.
+    """
+    return cached_arrays(
+        "half_spectrum",
+        (md, nd),
+        lambda: _half_spectrum_index(md, nd),
+        cache_dir=False,
+    )
+
+
+def _half_spectrum_index(
+    md,
+    nd,
+):
+    half = md * nd // 2
+    nr = nd // 2 + 1
+    i, j = np.divmod(np.arange(half), nd)
+    u, v = (i - md // 2) % md, (j - nd // 2) % nd
+    to_half_conj = v >= nr
+    u = np.where(to_half_conj, -u % md, u)
+    v = np.where(to_half_conj, -v % nd, v)
+    to_half = u * nr + v
+
+    u, v = np.divmod(np.arange(md * nr), nr)
+    p = (u + md // 2) % md * nd + (v + nd // 2) % nd
+    from_half_conj = p > half
+    from_half = np.where(from_half_conj, md * nd - 1 - p, p)
+    return to_half, to_half_conj, from_half, from_half_conj
+
+
+_aux_cache = {}
+
+
+def default_cache_dir():
+    """
+    Directory of the on-disk cache for geometry-only auxiliaries
+    (wedge masks, neighbour graphs and TV spectra).
+
+    Can be overridden with the environment variable LEONARDO_CACHE_DIR.
+    """
+    return os.environ.get(
+        "LEONARDO_CACHE_DIR",
+        os.path.join(os.path.expanduser("~"), ".cache", "leonardo_toolset"),
+    )
+
+
+def cached_arrays(
+    name,
+    key,
+    build_fn,
+    cache_dir=None,
+):
+    """
+    Return the arrays built by ``build_fn``, memoised in memory and on disk.
+
+    Parameters:
+    ---------------------
+    name: str
+        name of the cached quantity, used as file prefix
+    key: tuple
+        everything the result depends on (shapes, angles, backend, ...)
+    build_fn: callable
+        returns a tuple of arrays, only called on a cache miss
+    cache_dir: str, None or False
+        directory of the on-disk cache. default_cache_dir() if None,
+        in-memory caching only if False or ''.
+    """
+    digest = hashlib.sha1(repr((name,) + tuple(key)).encode()).hexdigest()
+    if digest in _aux_cache:
+        return _aux_cache[digest]
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    path = (
+        os.path.join(cache_dir, "destripe", f"{name}_{digest}.npz")
+        if cache_dir
+        else None
+    )
+    out = None
+    if (path is not None) and os.path.exists(path):
+        try:
+            with np.load(path) as f:
+                out = tuple(f[f"arr_{i}"] for i in range(len(f.files)))
+        except Exception:
+            out = None
+    if out is None:
+        out = tuple(np.asarray(x) for x in build_fn())
+        if path is not None:
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # write to a temporary file first, concurrent runs may share the cache
+                tmp = f"{path[:-4]}.{os.getpid()}.tmp.npz"
+                np.savez(tmp, *out)
+                os.replace(tmp, path)
+            except OSError:
+                pass
+    _aux_cache[digest] = out
+    return out
+
+
 def NeighborSampling(
     m,
     n,
@@ -340,10 +1041,42 @@ def prepare_aux(
     deg: float = 29,
     Nneighbors: int = 16,
     backend="jax",
+    cache_dir=None,
 ):
     if not is_vertical:
         (nd, md) = (md, nd)
 
+    hier_mask, hier_ind, NI = cached_arrays(
+        "aux",
+        (
+            md,
+            nd,
+            tuple(float(a) for a in angleOffset),
+            float(deg),
+            Nneighbors,
+            backend,
+        ),
+        lambda: _prepare_aux(md, nd, angleOffset, deg, Nneighbors, backend),
+        cache_dir=cache_dir,
+    )
+    if backend == "jax":
+        return jnp.asarray(hier_mask), jnp.asarray(hier_ind), jnp.asarray(NI)
+    else:
+        return (
+            torch.from_numpy(hier_mask),
+            torch.from_numpy(hier_ind),
+            torch.from_numpy(NI),
+        )
+
+
+def _prepare_aux(
+    md: int,
+    nd: int,
+    angleOffset: List[float],
+    deg: float,
+    Nneighbors: int,
+    backend: str,
+):
     if backend == "jax":
         dep_package = jnp
     else:
@@ -371,11 +1104,4 @@ def prepare_aux(
     NI = dep_package.concatenate(
         [NI_all[angle_mask == 0, :].T for angle_mask in angleMask], 1
     )  # 1 : Nneighbors + 1
-    if backend == "jax":
-        return hier_mask, hier_ind, NI
-    else:
-        return (
-            torch.from_numpy(hier_mask),
-            torch.from_numpy(hier_ind),
-            torch.from_numpy(NI),
-        )
+    return hier_mask, hier_ind, NI
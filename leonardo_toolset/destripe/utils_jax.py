@@ -173,6 +173,20 @@ def generate_mask_dict_jax(
     return mask_dict, targets_f, targetd_bilinear
 
 
+def enable_compilation_cache(
+    cache_dir,
+):
+    """
+    Persist compiled XLA executables in ``cache_dir``, so that new processes
+    (and new DeStripe instances) skip recompiling shapes seen before.
+    """
+    try:
+        jax.config.update("jax_compilation_cache_dir", cache_dir)
+        jax.config.update("jax_persistent_cache_min_compile_time_secs", 1.0)
+    except Exception as e:
+        print(f"Error: {e}. proceed without persistent compilation cache")
+
+
 def generate_mapping_matrix(
     angle,
     m,
@@ -303,3 +317,98 @@ class update_jax:
         grads = jax.tree_util.tree_map(jnp.conjugate, grads)
         opt_state = self.opt_update(step, grads, opt_state)
         return l, self.get_params(opt_state), opt_state, A
+
+    @partial(jit, static_argnums=(0))
+    def predict(
+        self,
+        params,
+        aver,
+        xf,
+        y,
+        mask_dict,
+        hy,
+        targets_f,
+        targetd_bilinear,
+    ):
+        _, A = self.loss(
+            params,
+            self._network,
+            {
+                "aver": aver,
+                "Xf": xf,
+                "target": y,
+                "target_hr": hy,
+                "coor": mask_dict["coor"],
+            },
+            targetd_bilinear,
+            mask_dict,
+            hy,
+            targets_f,
+        )
+        return A
+
+    def snapshot(
+        self,
+        params,
+        opt_state,
+    ):
+        # parameters and optimizer state are immutable pytrees
+        return params, opt_state
+
+    def restore(
+        self,
+        snapshot,
+    ):
+        return snapshot
+
+    def init_batch(
+        self,
+        net_params,
+        n_slices,
+        opt_state=None,
+    ):
+        params = jax.tree_util.tree_map(
+            lambda x: jnp.repeat(x[None], n_slices, 0), net_params
+        )
+        if opt_state is None:
+            return params, jax.vmap(self.opt_init)(params)
+        return params, jax.tree_util.tree_map(
+            lambda x: jnp.repeat(x[None], n_slices, 0), opt_state
+        )
+
+    def select_batch(
+        self,
+        params,
+        opt_state,
+        k,
+    ):
+        return (
+            jax.tree_util.tree_map(lambda x: x[k], params),
+            jax.tree_util.tree_map(lambda x: x[k], opt_state),
+        )
+
+    @partial(jit, static_argnums=(0))
+    def batch_call(
+        self,
+        step,
+        params,
+        opt_state,
+        aver,
+        xf,
+        y,
+        mask_dict,
+        hy,
+        targets_f,
+        targetd_bilinear,
+    ):
+        return jax.vmap(partial(self.__call__, step))(
+            params,
+            opt_state,
+            aver,
+            xf,
+            y,
+            mask_dict,
+            hy,
+            targets_f,
+            targetd_bilinear,
+        )
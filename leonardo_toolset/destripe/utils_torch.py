@@ -1,3 +1,5 @@
+import copy
+
 import numpy as np
 import torch
 import torch.nn.functional as F
@@ -18,14 +20,38 @@ class update_torch:
         network,
         Loss,
         learning_rate,
+        compile=False,
     ):
         self.learning_rate = learning_rate
         self.loss = Loss
         self._network = network
+        self._forward = self.forward
+        if compile:
+            try:
+                self._forward = torch.compile(self.forward)
+            except Exception as e:
+                print(f"Error: {e}. proceed without torch.compile")
 
     def opt_init(self, net_params):
         return torch.optim.Adam(net_params, lr=self.learning_rate)
 
+    def forward(
+        self,
+        inputs,
+        targetd_bilinear,
+        mask_dict,
+        hy,
+        targets_f,
+    ):
+        return self.loss(
+            self._network,
+            inputs,
+            targetd_bilinear,
+            mask_dict,
+            hy,
+            targets_f,
+        )
+
     def __call__(
         self,
         step,
@@ -39,24 +65,172 @@ class update_torch:
         targets_f,
         targetd_bilinear,
     ):
+        inputs = {
+            "aver": aver,
+            "Xf": xf,
+            "target": y,
+            "target_hr": hy,
+            "coor": mask_dict["coor"],
+        }
         optimizer.zero_grad()
-        l, A = self.loss(
-            self._network,
-            {
-                "aver": aver,
-                "Xf": xf,
-                "target": y,
-                "target_hr": hy,
-                "coor": mask_dict["coor"],
-            },
-            targetd_bilinear,
+        try:
+            l, A = self._forward(inputs, targetd_bilinear, mask_dict, hy, targets_f)
+            l.backward()
+        except Exception as e:
+            if self._forward == self.forward:
+                raise
+            # compilation is lazy, so failures only show up at the first step
+            print(f"Error: {e}. torch.compile failed, proceed in eager mode")
+            self._forward = self.forward
+            optimizer.zero_grad()
+            l, A = self._forward(inputs, targetd_bilinear, mask_dict, hy, targets_f)
+            l.backward()
+        optimizer.step()
+        return l, self._network.parameters(), optimizer, A
+
+    def predict(
+        self,
+        params,
+        aver,
+        xf,
+        y,
+        mask_dict,
+        hy,
+        targets_f,
+        targetd_bilinear,
+    ):
+        with torch.no_grad():
+            _, A = self.loss(
+                self._network,
+                {
+                    "aver": aver,
+                    "Xf": xf,
+                    "target": y,
+                    "target_hr": hy,
+                    "coor": mask_dict["coor"],
+                },
+                targetd_bilinear,
+                mask_dict,
+                hy,
+                targets_f,
+            )
+        return A
+
+    def snapshot(
+        self,
+        params,
+        optimizer,
+    ):
+        return (
+            {k: v.detach().clone() for k, v in self._network.named_parameters()},
+            copy.deepcopy(optimizer.state_dict()),
+        )
+
+    def restore(
+        self,
+        snapshot,
+    ):
+        net_params, opt_state = snapshot
+        with torch.no_grad():
+            for k, v in self._network.named_parameters():
+                v.copy_(net_params[k])
+        optimizer = self.opt_init(self._network.parameters())
+        optimizer.load_state_dict(copy.deepcopy(opt_state))
+        return self._network.parameters(), optimizer
+
+    def init_batch(
+        self,
+        net_params,
+        n_slices,
+        opt_state=None,
+    ):
+        params = {
+            k: v.detach().unsqueeze(0).repeat_interleave(n_slices, 0).requires_grad_()
+            for k, v in self._network.named_parameters()
+        }
+        optimizer = self.opt_init(params.values())
+        if opt_state is not None:
+            for k, v in self._network.named_parameters():
+                optimizer.state[params[k]] = {
+                    key: (
+                        s.unsqueeze(0).repeat_interleave(n_slices, 0)
+                        if torch.is_tensor(s) and s.dim() > 0
+                        else copy.deepcopy(s)
+                    )
+                    for key, s in opt_state.state.get(v, {}).items()
+                }
+        return params, optimizer
+
+    def select_batch(
+        self,
+        params,
+        optimizer,
+        k,
+    ):
+        with torch.no_grad():
+            for name, v in self._network.named_parameters():
+                v.copy_(params[name][k])
+        opt_state = self.opt_init(self._network.parameters())
+        for name, v in self._network.named_parameters():
+            opt_state.state[v] = {
+                key: (
+                    s[k].clone()
+                    if torch.is_tensor(s) and s.dim() > 0
+                    else copy.deepcopy(s)
+                )
+                for key, s in optimizer.state.get(params[name], {}).items()
+            }
+        return self._network.parameters(), opt_state
+
+    def batch_call(
+        self,
+        step,
+        params,
+        optimizer,
+        aver,
+        xf,
+        y,
+        mask_dict,
+        hy,
+        targets_f,
+        targetd_bilinear,
+    ):
+        buffers = dict(self._network.named_buffers())
+
+        def loss_one_slice(p, aver, xf, y, mask_dict, hy, targets_f, targetd_bilinear):
+            return self.loss(
+                lambda **x: torch.func.functional_call(
+                    self._network, (p, buffers), kwargs=x
+                ),
+                {
+                    "aver": aver,
+                    "Xf": xf,
+                    "target": y,
+                    "target_hr": hy,
+                    "coor": mask_dict["coor"],
+                },
+                targetd_bilinear,
+                mask_dict,
+                hy,
+                targets_f,
+            )
+
+        optimizer.zero_grad()
+        l, A = torch.func.vmap(loss_one_slice)(
+            params,
+            aver,
+            xf,
+            y,
             mask_dict,
             hy,
             targets_f,
+            targetd_bilinear,
         )
-        l.backward()
+        # slices share no parameters, so the gradient of the summed loss
+        # is the per-slice gradient, and Adam acts element-wise on it
+        l.sum().backward()
         optimizer.step()
-        return l, self._network.parameters(), optimizer, A
+        return l, params, optimizer, A
 
 
 def generate_mask_dict_torch(